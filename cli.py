@@ -0,0 +1,169 @@
+"""Единая точка входа: генерация, консолидация и загрузка котировок.
+
+Примеры:
+
+    # только Parquet, 150 строк на символ, без Excel и облака
+    python cli.py --rows 150 --formats parquet --stages generate
+
+    # все этапы, как create_files_2.py
+    python cli.py --rows 150 --formats xlsx parquet --stages generate consolidate upload
+
+    # свои символы, Arrow + CSV, 8 процессов
+    python cli.py --symbols USD/RUB EUR/RUB --formats arrow csv --jobs 8
+
+Символы генерируются параллельно в отдельных процессах, загрузки идут
+в потоках и начинаются сразу по готовности файлов, параллельно
+с консолидацией.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from metrics import absorb, run_captured, stage
+
+DEFAULT_SYMBOLS = ['CNY/RUB', 'USD/RUB', 'EUR/RUB', 'INR/RUB']
+FORMATS = ("xlsx", "parquet", "arrow", "csv")
+STAGES = ("generate", "consolidate", "upload")
+FILE_PREFIX = "database"
+
+
+def reserve_file_numbers(count, today, prefix=FILE_PREFIX):
+    """Возвращает count последовательных свободных номеров файлов на сегодня.
+
+    Номера файлов, уже слитых компактизацией (database_<дата>_<СИМВОЛ>_part<k>),
+    тоже считаются занятыми: иначе новый файл получил бы имя уже учтённого
+    в агрегатах исходника.
+    """
+    from storage import compacted_sources
+
+    pattern = f"{prefix}_{today}_"
+    names = []
+    for file in os.listdir('.'):
+        if not file.startswith(pattern):
+            continue
+        if "_part" in file and file.endswith(".parquet"):
+            try:
+                names.extend(name for name in compacted_sources(file) if name)
+            except Exception as e:
+                print(f"⚠️ Не удалось прочитать {file}: {e}")
+        else:
+            names.append(file)
+    numbers = []
+    for name in names:
+        if name.startswith(pattern):
+            try:
+                numbers.append(int(name[len(pattern):].split('.')[0]))
+            except ValueError:
+                continue
+    start = max(numbers) + 1 if numbers else 1
+    return list(range(start, start + count))
+
+
+def generate_symbol_files(symbol, num_rows, file_number, today, formats, parquet_options=None):
+    """Генерирует данные одного символа и записывает их в выбранных форматах.
+
+    Выполняется в отдельном процессе; возвращает список созданных файлов.
+    """
+    import pandas as pd
+    from create_files_2 import generate_random_data
+    from storage import write_arrow, write_csv, write_excel, write_parquet
+
+    with stage("generate", rows=num_rows, symbol=symbol):
+        df = pd.DataFrame(generate_random_data(num_rows, symbol))
+
+    base = f"{FILE_PREFIX}_{today}_{file_number}"
+    writers = {
+        "parquet": lambda path: write_parquet(df, path, **(parquet_options or {})),
+        "arrow": lambda path: write_arrow(df, path),
+        "csv": lambda path: write_csv(df, path),
+        "xlsx": lambda path: write_excel(df, path),
+    }
+    created = []
+    for fmt in formats:
+        path = f"{base}.{fmt}"
+        with stage(f"{fmt}_write", rows=len(df), file=path) as m:
+            m.add_bytes(writers[fmt](path))
+        created.append(path)
+    return created
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Генерация, консолидация и загрузка котировок")
+    parser.add_argument("--rows", type=int, default=150, help="Строк на символ (по умолчанию 150)")
+    parser.add_argument("--symbols", nargs="+", default=DEFAULT_SYMBOLS, help="Список символов")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=["parquet"],
+                        help="Форматы вывода (по умолчанию только parquet)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=["generate", "consolidate"],
+                        help="Этапы (по умолчанию generate consolidate)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Процессов для генерации")
+    parser.add_argument("--upload-workers", type=int, default=4, help="Потоков для загрузки")
+    parser.add_argument("--compression", help="Кодек Parquet (snappy, zstd, ...)")
+    parser.add_argument("--compression-level", type=int, help="Уровень сжатия Parquet")
+    parser.add_argument("--files", nargs="+", default=[],
+                        help="Уже существующие файлы для загрузки на этапе upload")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = set(args.stages)
+    parquet_options = {"compression": args.compression, "compression_level": args.compression_level}
+    if {"generate", "consolidate"} <= stages and "parquet" not in args.formats:
+        print("⚠️ Консолидация читает только database_*.parquet: новые данные без --formats parquet в неё не попадут")
+
+    upload_pool = None
+    uploads = []
+    if "upload" in stages:
+        from cloud_settings import get_obs_settings
+        from create_files_2 import upload_to_cloud
+
+        # Учётные данные проверяем до начала работы
+        get_obs_settings()
+        upload_pool = ThreadPoolExecutor(max_workers=args.upload_workers)
+        uploads = [upload_pool.submit(upload_to_cloud, path) for path in args.files]
+
+    try:
+        if "generate" in stages:
+            today = datetime.now().strftime("%Y-%m-%d")
+            numbers = reserve_file_numbers(len(args.symbols), today)
+            jobs = max(1, min(args.jobs, len(args.symbols)))
+            print(f"📊 Генерация: {len(args.symbols)} символов × {args.rows} строк, "
+                  f"форматы {', '.join(args.formats)}, процессов {jobs}")
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = [
+                    pool.submit(run_captured, generate_symbol_files, symbol, args.rows, number, today,
+                                args.formats, parquet_options)
+                    for symbol, number in zip(args.symbols, numbers)
+                ]
+                for future in futures:
+                    created, records = future.result()
+                    absorb(records)
+                    for path in created:
+                        print(f"✅ Создан файл: {path}")
+                        if upload_pool is not None:
+                            uploads.append(upload_pool.submit(upload_to_cloud, path))
+
+        if "consolidate" in stages:
+            from create_files_2 import create_consolidated_database
+
+            print("🔄 Консолидация данных...")
+            # Arrow IPC копию консолидированной базы пишем, если выбран формат arrow
+            consolidated_file = create_consolidated_database(upload_enabled=False,
+                                                             parquet_options=parquet_options,
+                                                             arrow_output="arrow" in args.formats)
+            if consolidated_file and upload_pool is not None:
+                uploads.append(upload_pool.submit(upload_to_cloud, consolidated_file))
+
+        for future in uploads:
+            future.result()
+    finally:
+        if upload_pool is not None:
+            upload_pool.shutdown(wait=True)
+
+    print("✅ Готово")
+
+
+if __name__ == "__main__":
+    main()
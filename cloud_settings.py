@@ -0,0 +1,35 @@
+"""Параметры подключения к S3-совместимому облаку (OBS).
+
+Переменные окружения (или .env) читаются и проверяются только при первом
+обращении к get_obs_settings(), т.е. когда действительно нужна загрузка.
+Локальные запуски без облака не требуют ни учётных данных, ни boto3.
+"""
+import os
+
+REQUIRED_VARS = ("OBS_ACCESS_KEY", "OBS_SECRET_KEY", "OBS_REGION", "OBS_ENDPOINT", "OBS_BUCKET")
+
+_settings = None
+
+
+def get_obs_settings():
+    """Возвращает словарь OBS_* параметров, проверяя что все они заданы"""
+    global _settings
+    if _settings is not None:
+        return _settings
+
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        pass
+    else:
+        # Загружаем переменные окружения
+        load_dotenv()
+
+    settings = {name: os.getenv(name) for name in REQUIRED_VARS}
+    for name, value in settings.items():
+        if not value:
+            raise EnvironmentError(f"Переменная окружения {name} не задана в .env файле")
+
+    _settings = settings
+    return _settings
+
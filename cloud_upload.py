@@ -0,0 +1,436 @@
+"""Загрузка в облако с повторами и возобновлением multipart-загрузки.
+
+Мелкие файлы (меньше одной части) отправляются put_object, крупные —
+multipart-загрузкой. После каждой успешно загруженной части её номер и
+ETag сохраняются в контрольную точку .upload_checkpoints/<хеш>.json,
+поэтому прерванная загрузка продолжается с первой недостающей части,
+а не с нуля. Контрольная точка привязана к размеру и mtime файла:
+если файл изменился, прежняя multipart-загрузка отменяется
+(abort_multipart_upload, чтобы её части не оставались в бакете)
+и загрузка начинается заново.
+
+Сетевые ошибки, таймауты, 5xx и throttling повторяются с экспоненциальной
+задержкой и полным джиттером; ошибки доступа и прочие 4xx — нет.
+
+Проверка на локальном S3 (moto server / MinIO) с инъекцией сбоев:
+
+    moto_server -p 5000 &
+    python cloud_upload.py big.parquet --endpoint http://127.0.0.1:5000 \\
+        --bucket test --create-bucket --fault-rate 0.3
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+
+PART_SIZE = 8 * 1024 * 1024  # S3 требует не меньше 5 МБ на часть (кроме последней)
+MAX_ATTEMPTS = 6
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+CHECKPOINT_DIR = ".upload_checkpoints"
+
+RETRYABLE_CODES = {
+    "RequestTimeout", "RequestTimeoutException", "InternalError", "ServiceUnavailable",
+    "SlowDown", "Throttling", "ThrottlingException", "RequestLimitExceeded", "BadDigest",
+}
+
+
+def content_type_for(filepath):
+    """Определяет Content-Type по расширению файла"""
+    if filepath.lower().endswith('.xlsx'):
+        return 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return 'application/octet-stream'
+
+
+def make_s3_client():
+    """boto3-клиент для OBS с параметрами из окружения"""
+    import boto3
+    from botocore.config import Config
+    from cloud_settings import get_obs_settings
+
+    obs = get_obs_settings()
+    return boto3.session.Session().client(
+        's3',
+        region_name=obs["OBS_REGION"],
+        endpoint_url=obs["OBS_ENDPOINT"],
+        aws_access_key_id=obs["OBS_ACCESS_KEY"],
+        aws_secret_access_key=obs["OBS_SECRET_KEY"],
+        config=Config(s3={'addressing_style': 'virtual'})
+    )
+
+
+def is_retryable(error):
+    """Стоит ли повторять запрос после этой ошибки"""
+    try:
+        from botocore.exceptions import (ClientError, ConnectionError as BotoConnectionError,
+                                         HTTPClientError)
+    except ImportError:
+        ClientError = BotoConnectionError = HTTPClientError = ()
+
+    if ClientError and isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return code in RETRYABLE_CODES or status >= 500
+    if BotoConnectionError and isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError, InjectedFault))
+
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Экспоненциальная задержка с полным джиттером (attempt с нуля)"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def with_retries(func, *args, max_attempts=MAX_ATTEMPTS, description="", **kwargs):
+    """Вызывает func, повторяя при временных ошибках"""
+    for attempt in range(max_attempts):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt + 1 >= max_attempts or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt)
+            print(f"⚠️ {description or func.__name__}: {e} — повтор {attempt + 2}/{max_attempts} через {delay:.1f} с")
+            time.sleep(delay)
+
+
+async def with_retries_async(func, *args, max_attempts=MAX_ATTEMPTS, description="", **kwargs):
+    """Асинхронный вариант with_retries для aiobotocore"""
+    for attempt in range(max_attempts):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            if attempt + 1 >= max_attempts or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt)
+            print(f"⚠️ {description or func.__name__}: {e} — повтор {attempt + 2}/{max_attempts} через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+
+# --- Контрольные точки ---
+
+def _checkpoint_path(bucket, key, checkpoint_dir):
+    digest = hashlib.sha1(f"{bucket}/{key}".encode()).hexdigest()
+    return os.path.join(checkpoint_dir, f"{digest}.json")
+
+
+def _file_signature(filepath):
+    stat = os.stat(filepath)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_checkpoint(bucket, key, checkpoint_dir=CHECKPOINT_DIR):
+    """Сохранённая контрольная точка для объекта (без проверки актуальности)"""
+    path = _checkpoint_path(bucket, key, checkpoint_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_current(checkpoint, filepath, part_size):
+    return (checkpoint.get("file") == os.path.abspath(filepath)
+            and checkpoint.get("signature") == _file_signature(filepath)
+            and checkpoint.get("part_size") == part_size)
+
+
+def load_checkpoint(filepath, bucket, key, part_size, checkpoint_dir=CHECKPOINT_DIR):
+    """Контрольная точка для этого файла, если она ещё действительна"""
+    checkpoint = read_checkpoint(bucket, key, checkpoint_dir)
+    if checkpoint is None or not _is_current(checkpoint, filepath, part_size):
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint, checkpoint_dir=CHECKPOINT_DIR):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = _checkpoint_path(checkpoint["bucket"], checkpoint["key"], checkpoint_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def remove_checkpoint(bucket, key, checkpoint_dir=CHECKPOINT_DIR):
+    path = _checkpoint_path(bucket, key, checkpoint_dir)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _new_checkpoint(filepath, bucket, key, part_size, upload_id):
+    return {
+        "file": os.path.abspath(filepath),
+        "signature": _file_signature(filepath),
+        "bucket": bucket,
+        "key": key,
+        "part_size": part_size,
+        "upload_id": upload_id,
+        "parts": {},
+    }
+
+
+def _read_part(filepath, part_number, part_size):
+    with open(filepath, "rb") as f:
+        f.seek((part_number - 1) * part_size)
+        return f.read(part_size)
+
+
+def _completed_parts(checkpoint):
+    return [{"PartNumber": int(n), "ETag": etag}
+            for n, etag in sorted(checkpoint["parts"].items(), key=lambda item: int(item[0]))]
+
+
+def _is_missing_upload(error):
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") == "NoSuchUpload"
+
+
+def _stale_upload_id(filepath, bucket, key, part_size, checkpoint_dir):
+    """upload_id устаревшей контрольной точки (файл изменился), иначе None"""
+    checkpoint = read_checkpoint(bucket, key, checkpoint_dir)
+    if checkpoint is None or _is_current(checkpoint, filepath, part_size):
+        return None
+    return checkpoint.get("upload_id")
+
+
+def _list_parts(client, bucket, key, upload_id):
+    parts = {}
+    for page in client.get_paginator("list_parts").paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            parts[str(part["PartNumber"])] = part["ETag"]
+    return parts
+
+
+async def _list_parts_async(client, bucket, key, upload_id):
+    parts = {}
+    async for page in client.get_paginator("list_parts").paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            parts[str(part["PartNumber"])] = part["ETag"]
+    return parts
+
+
+# --- Синхронная загрузка (boto3) ---
+
+def resumable_upload(filepath, key=None, client=None, bucket=None, content_type=None,
+                     part_size=PART_SIZE, checkpoint_dir=CHECKPOINT_DIR, max_attempts=MAX_ATTEMPTS):
+    """Загружает файл с повторами; крупные файлы — с возобновлением по частям.
+
+    Возвращает число отправленных в этом вызове байт.
+    """
+    if client is None:
+        client = make_s3_client()
+    if bucket is None:
+        from cloud_settings import get_obs_settings
+        bucket = get_obs_settings()["OBS_BUCKET"]
+    key = key or os.path.basename(filepath)
+    content_type = content_type or content_type_for(filepath)
+    size = os.path.getsize(filepath)
+
+    # Файл изменился после прерванной загрузки — её части больше не нужны
+    stale_id = _stale_upload_id(filepath, bucket, key, part_size, checkpoint_dir)
+    if stale_id:
+        try:
+            with_retries(client.abort_multipart_upload, Bucket=bucket, Key=key, UploadId=stale_id,
+                         max_attempts=max_attempts, description=f"abort_multipart_upload {key}")
+        except Exception as e:
+            if not _is_missing_upload(e):
+                raise
+        remove_checkpoint(bucket, key, checkpoint_dir)
+        print(f"🗑️ {key}: файл изменился, прежняя загрузка отменена")
+
+    if size <= part_size:
+        with open(filepath, "rb") as f:
+            body = f.read()
+        with_retries(client.put_object, Bucket=bucket, Key=key, Body=body, ContentType=content_type,
+                     max_attempts=max_attempts, description=f"put_object {key}")
+        return size
+
+    checkpoint = load_checkpoint(filepath, bucket, key, part_size, checkpoint_dir)
+    if checkpoint is not None:
+        try:
+            # Сервер — источник истины о загруженных частях
+            checkpoint["parts"].update(with_retries(
+                _list_parts, client, bucket, key, checkpoint["upload_id"],
+                max_attempts=max_attempts, description=f"list_parts {key}"))
+            print(f"🔄 Продолжаем загрузку {key}: готово {len(checkpoint['parts'])} частей")
+        except Exception as e:
+            if not _is_missing_upload(e):
+                raise
+            checkpoint = None
+
+    if checkpoint is None:
+        response = with_retries(client.create_multipart_upload, Bucket=bucket, Key=key,
+                                ContentType=content_type, max_attempts=max_attempts,
+                                description=f"create_multipart_upload {key}")
+        checkpoint = _new_checkpoint(filepath, bucket, key, part_size, response["UploadId"])
+        save_checkpoint(checkpoint, checkpoint_dir)
+
+    sent = 0
+    total_parts = (size + part_size - 1) // part_size
+    for part_number in range(1, total_parts + 1):
+        if str(part_number) in checkpoint["parts"]:
+            continue
+        body = _read_part(filepath, part_number, part_size)
+        response = with_retries(client.upload_part, Bucket=bucket, Key=key,
+                                UploadId=checkpoint["upload_id"], PartNumber=part_number, Body=body,
+                                max_attempts=max_attempts, description=f"upload_part {key} #{part_number}")
+        checkpoint["parts"][str(part_number)] = response["ETag"]
+        save_checkpoint(checkpoint, checkpoint_dir)
+        sent += len(body)
+
+    with_retries(client.complete_multipart_upload, Bucket=bucket, Key=key,
+                 UploadId=checkpoint["upload_id"], MultipartUpload={"Parts": _completed_parts(checkpoint)},
+                 max_attempts=max_attempts, description=f"complete_multipart_upload {key}")
+    remove_checkpoint(bucket, key, checkpoint_dir)
+    return sent
+
+
+# --- Асинхронная загрузка (aiobotocore) ---
+
+async def resumable_upload_async(client, filepath, bucket, key=None, content_type=None,
+                                 part_size=PART_SIZE, checkpoint_dir=CHECKPOINT_DIR,
+                                 max_attempts=MAX_ATTEMPTS):
+    """То же, что resumable_upload, для асинхронного клиента aiobotocore"""
+    key = key or os.path.basename(filepath)
+    content_type = content_type or content_type_for(filepath)
+    size = os.path.getsize(filepath)
+
+    stale_id = _stale_upload_id(filepath, bucket, key, part_size, checkpoint_dir)
+    if stale_id:
+        try:
+            await with_retries_async(client.abort_multipart_upload, Bucket=bucket, Key=key,
+                                     UploadId=stale_id, max_attempts=max_attempts,
+                                     description=f"abort_multipart_upload {key}")
+        except Exception as e:
+            if not _is_missing_upload(e):
+                raise
+        remove_checkpoint(bucket, key, checkpoint_dir)
+        print(f"🗑️ {key}: файл изменился, прежняя загрузка отменена")
+
+    if size <= part_size:
+        with open(filepath, "rb") as f:
+            body = f.read()
+        await with_retries_async(client.put_object, Bucket=bucket, Key=key, Body=body,
+                                 ContentType=content_type, max_attempts=max_attempts,
+                                 description=f"put_object {key}")
+        return size
+
+    checkpoint = load_checkpoint(filepath, bucket, key, part_size, checkpoint_dir)
+    if checkpoint is not None:
+        try:
+            checkpoint["parts"].update(await with_retries_async(
+                _list_parts_async, client, bucket, key, checkpoint["upload_id"],
+                max_attempts=max_attempts, description=f"list_parts {key}"))
+            print(f"🔄 Продолжаем загрузку {key}: готово {len(checkpoint['parts'])} частей")
+        except Exception as e:
+            if not _is_missing_upload(e):
+                raise
+            checkpoint = None
+
+    if checkpoint is None:
+        response = await with_retries_async(client.create_multipart_upload, Bucket=bucket, Key=key,
+                                            ContentType=content_type, max_attempts=max_attempts,
+                                            description=f"create_multipart_upload {key}")
+        checkpoint = _new_checkpoint(filepath, bucket, key, part_size, response["UploadId"])
+        save_checkpoint(checkpoint, checkpoint_dir)
+
+    sent = 0
+    total_parts = (size + part_size - 1) // part_size
+    for part_number in range(1, total_parts + 1):
+        if str(part_number) in checkpoint["parts"]:
+            continue
+        body = _read_part(filepath, part_number, part_size)
+        response = await with_retries_async(client.upload_part, Bucket=bucket, Key=key,
+                                            UploadId=checkpoint["upload_id"], PartNumber=part_number,
+                                            Body=body, max_attempts=max_attempts,
+                                            description=f"upload_part {key} #{part_number}")
+        checkpoint["parts"][str(part_number)] = response["ETag"]
+        save_checkpoint(checkpoint, checkpoint_dir)
+        sent += len(body)
+
+    await with_retries_async(client.complete_multipart_upload, Bucket=bucket, Key=key,
+                             UploadId=checkpoint["upload_id"],
+                             MultipartUpload={"Parts": _completed_parts(checkpoint)},
+                             max_attempts=max_attempts, description=f"complete_multipart_upload {key}")
+    remove_checkpoint(bucket, key, checkpoint_dir)
+    return sent
+
+
+# --- Инъекция сбоев для проверки на локальном S3 ---
+
+class InjectedFault(ConnectionError):
+    """Искусственный сетевой сбой от FaultInjectingClient"""
+
+
+class FaultInjectingClient:
+    """Обёртка над boto3-клиентом, случайно «роняющая» выбранные вызовы.
+
+    fail_after_parts — после стольких успешных upload_part все следующие
+    вызовы падают (имитация обрыва посреди загрузки, чтобы проверить
+    возобновление по контрольной точке).
+    """
+
+    def __init__(self, client, fault_rate=0.0, operations=("put_object", "upload_part"),
+                 fail_after_parts=None, seed=None):
+        self._client = client
+        self._fault_rate = fault_rate
+        self._operations = set(operations)
+        self._fail_after_parts = fail_after_parts
+        self._parts_done = 0
+        self._random = random.Random(seed)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self._operations or not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            if self._fail_after_parts is not None and self._parts_done >= self._fail_after_parts:
+                raise InjectedFault(f"{name}: соединение потеряно (имитация обрыва)")
+            if self._random.random() < self._fault_rate:
+                raise InjectedFault(f"{name}: случайный сбой")
+            result = attr(*args, **kwargs)
+            if name == "upload_part":
+                self._parts_done += 1
+            return result
+        return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка файла с повторами и возобновлением")
+    parser.add_argument("file", help="Файл для загрузки")
+    parser.add_argument("--key", help="Имя объекта (по умолчанию имя файла)")
+    parser.add_argument("--part-size-mb", type=float, default=PART_SIZE / 1024 / 1024, help="Размер части, МБ")
+    parser.add_argument("--endpoint", help="Локальный S3 (moto/MinIO) вместо OBS из окружения")
+    parser.add_argument("--bucket", help="Бакет для --endpoint")
+    parser.add_argument("--create-bucket", action="store_true", help="Создать бакет на локальном S3")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="Доля вызовов, падающих с ошибкой")
+    parser.add_argument("--fail-after-parts", type=int, help="Оборвать загрузку после N частей")
+    args = parser.parse_args()
+
+    if args.endpoint:
+        import boto3
+        client = boto3.client("s3", endpoint_url=args.endpoint, region_name="us-east-1",
+                              aws_access_key_id="test", aws_secret_access_key="test")
+        bucket = args.bucket or "test"
+        if args.create_bucket:
+            client.create_bucket(Bucket=bucket)
+    else:
+        client, bucket = make_s3_client(), args.bucket
+
+    if args.fault_rate or args.fail_after_parts is not None:
+        client = FaultInjectingClient(client, args.fault_rate, fail_after_parts=args.fail_after_parts)
+
+    sent = resumable_upload(args.file, args.key, client=client, bucket=bucket,
+                            part_size=int(args.part_size_mb * 1024 * 1024))
+    print(f"✅ Загружено: {args.key or os.path.basename(args.file)} (отправлено {sent} байт)")
+
+
+if __name__ == "__main__":
+    main()
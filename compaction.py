@@ -0,0 +1,293 @@
+"""Компактизация мелких database_*.parquet файлов и удаление старых данных.
+
+Мелкие файлы одного дня объединяются по символам в файлы целевого размера:
+
+    database_<дата>_<n>.parquet            ->  database_<дата>_<СИМВОЛ>_part<k>.parquet
+    database_<дата>_xlsx_<книга>.parquet   ->  (ingest_excel.py, туда же)
+
+Новые имена тоже начинаются с database_ и заканчиваются на .parquet,
+поэтому консолидация и остальные читатели подхватывают их без изменений.
+Строки внутри файла отсортированы по времени, а колонка source_file
+хранит имя исходного файла каждой строки. В метаданных (source_identities)
+записан ключ каждого исходного файла (storage.file_identity): по нему
+rollups.py отличает уже учтённые строки, а cli.py не выдаёт номер
+исходного файла повторно.
+
+Замена атомарна: результаты пишутся во временные файлы, затем журнал
+.compaction_<дата>.json фиксирует что на что меняется, после чего
+временные файлы переименовываются (os.replace), а исходные удаляются.
+Если процесс прервать, следующий запуск доведёт замену до конца по журналу
+или удалит незафиксированные временные файлы.
+
+Переименование и удаление — отдельные шаги, и читатель, заставший каталог
+между ними, увидел бы и результаты, и исходники. Поэтому консолидация и
+агрегаты берут список файлов через list_data_files: пока журнал на месте,
+из списка убираются либо исходники (все результаты уже на месте), либо
+результаты (переименованы ещё не все).
+
+Примеры:
+
+    python compaction.py --target-size-mb 64 --retention-days 30
+    python compaction.py --dry-run
+"""
+import argparse
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+from metrics import stage
+from storage import SOURCE_IDENTITIES_KEY, file_identity, parquet_write_kwargs, source_identities
+
+RAW_RE = re.compile(r"^database_(\d{4}-\d{2}-\d{2})_(\d+)\.parquet$")
+# Книги, загруженные ingest_excel.py
+XLSX_RE = re.compile(r"^database_(\d{4}-\d{2}-\d{2})_xlsx_.+\.parquet$")
+COMPACTED_RE = re.compile(r"^database_(\d{4}-\d{2}-\d{2})_([A-Za-z0-9]+)_part(\d+)\.parquet$")
+# Все файлы данных, на которые распространяется срок хранения
+RETENTION_RE = re.compile(r"^(?:consolidated_)?database_(\d{4}-\d{2}-\d{2})(?:_[^.]+)?\.[A-Za-z]+$")
+JOURNAL_PREFIX = ".compaction_"
+TMP_SUFFIX = ".compacting"
+
+
+def symbol_key(symbol):
+    """CNY/RUB -> CNYRUB (для имени файла)"""
+    return "".join(ch for ch in str(symbol) if ch.isalnum()) or "UNKNOWN"
+
+
+def _read_journals(directory):
+    """{имя журнала: содержимое} незавершённых компактизаций"""
+    journals = {}
+    for name in os.listdir(directory):
+        if name.startswith(JOURNAL_PREFIX) and name.endswith(".json"):
+            try:
+                with open(os.path.join(directory, name), encoding="utf-8") as f:
+                    journals[name] = json.load(f)
+            except (FileNotFoundError, ValueError):
+                # Замена только что завершилась
+                continue
+    return journals
+
+
+def list_data_files(directory="."):
+    """Имена database_*.parquet без двойного учёта строк идущей компактизации.
+
+    Список каталога берётся между двумя одинаковыми чтениями журналов,
+    поэтому он согласован с ними: для каждого журнала остаются либо
+    исходники, либо результаты.
+    """
+    for _ in range(10):
+        journals = _read_journals(directory)
+        names = {name for name in os.listdir(directory)
+                 if name.startswith("database_") and name.endswith(".parquet")}
+        if _read_journals(directory) == journals:
+            break
+    for journal in journals.values():
+        finals = {final for _, final in journal["outputs"]}
+        if finals <= names:
+            names -= set(journal["inputs"])
+        else:
+            names -= finals
+    return sorted(names)
+
+
+def recover(directory="."):
+    """Доводит до конца прерванные замены и удаляет брошенные временные файлы"""
+    for name in os.listdir(directory):
+        if name.startswith(JOURNAL_PREFIX) and name.endswith(".json"):
+            journal_path = os.path.join(directory, name)
+            with open(journal_path, encoding="utf-8") as f:
+                journal = json.load(f)
+            for tmp, final in journal["outputs"]:
+                if os.path.exists(os.path.join(directory, tmp)):
+                    os.replace(os.path.join(directory, tmp), os.path.join(directory, final))
+            for source in journal["inputs"]:
+                if os.path.exists(os.path.join(directory, source)):
+                    os.remove(os.path.join(directory, source))
+            os.remove(journal_path)
+            print(f"🔄 Восстановлена прерванная компактизация: {name}")
+
+    for name in os.listdir(directory):
+        if name.endswith(TMP_SUFFIX):
+            os.remove(os.path.join(directory, name))
+            print(f"🗑️ Удалён незавершённый файл: {name}")
+
+
+def find_candidates(directory, target_bytes, min_age):
+    """Мелкие файлы по дням: {дата: [имена]}.
+
+    Берутся исходные database_<дата>_<n>.parquet, загруженные книги
+    database_<дата>_xlsx_*.parquet и недобравшие до половины
+    целевого размера результаты прошлых компактизаций. Файлы моложе
+    min_age секунд пропускаются — их ещё могут дописывать.
+    """
+    now = time.time()
+    by_day = {}
+    for name in os.listdir(directory):
+        match = RAW_RE.match(name) or XLSX_RE.match(name) or COMPACTED_RE.match(name)
+        if not match:
+            continue
+        stat = os.stat(os.path.join(directory, name))
+        if now - stat.st_mtime < min_age:
+            continue
+        if COMPACTED_RE.match(name) and stat.st_size >= target_bytes // 2:
+            continue
+        by_day.setdefault(match.group(1), []).append(name)
+    return by_day
+
+
+def _next_part_numbers(directory, day):
+    numbers = {}
+    for name in os.listdir(directory):
+        match = COMPACTED_RE.match(name)
+        if match and match.group(1) == day:
+            key = match.group(2)
+            numbers[key] = max(numbers.get(key, 0), int(match.group(3)))
+    return numbers
+
+
+def compact_day(directory, day, names, target_bytes, parquet_options=None, dry_run=False):
+    """Объединяет файлы одного дня в файлы по символам целевого размера"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    if len(names) < 2:
+        return 0
+
+    # Группы: символ -> список (таблица, оценка размера на диске)
+    groups = {}
+    identities = {}
+    for name in sorted(names):
+        path = os.path.join(directory, name)
+        try:
+            table = pq.read_table(path)
+        except Exception as e:
+            print(f"❌ Ошибка при чтении файла {name}: {e}")
+            names = [n for n in names if n != name]
+            continue
+        file_size = os.path.getsize(path)
+        # Запоминаем исходный файл строк: по нему rollups.py не учтёт их повторно
+        if "source_file" not in table.column_names:
+            identities[name] = file_identity(path)
+            table = table.append_column("source_file", pa.array([name] * table.num_rows, pa.string()))
+        else:
+            identities.update(source_identities(table.schema))
+        table = table.replace_schema_metadata(None)
+        if "symbol" not in table.column_names or table.num_rows == 0:
+            groups.setdefault("UNKNOWN", []).append((table, file_size))
+            continue
+        for symbol in pc.unique(table["symbol"]).to_pylist():
+            part = table.filter(pc.equal(table["symbol"], symbol))
+            groups.setdefault(symbol_key(symbol), []).append(
+                (part, file_size * part.num_rows // table.num_rows))
+
+    if dry_run:
+        print(f"🔍 {day}: {len(names)} файлов -> символов {len(groups)}")
+        return len(names)
+
+    next_parts = _next_part_numbers(directory, day)
+    outputs = []
+
+    def flush(key, chunk):
+        merged = pa.concat_tables(chunk, promote_options="default")
+        if "time" in merged.column_names:
+            merged = merged.sort_by("time")
+        present = pc.unique(merged["source_file"]).to_pylist()
+        merged = merged.replace_schema_metadata({SOURCE_IDENTITIES_KEY: json.dumps(
+            {source: identities[source] for source in present if source in identities},
+            ensure_ascii=False).encode()})
+        next_parts[key] = next_parts.get(key, 0) + 1
+        final = f"database_{day}_{key}_part{next_parts[key]}.parquet"
+        tmp = final + TMP_SUFFIX
+        pq.write_table(merged, os.path.join(directory, tmp),
+                       **parquet_write_kwargs(merged.schema, **(parquet_options or {})))
+        outputs.append((tmp, final))
+
+    for key, parts in groups.items():
+        chunk, chunk_bytes = [], 0
+        for table, size in parts:
+            chunk.append(table)
+            chunk_bytes += size
+            if chunk_bytes >= target_bytes:
+                flush(key, chunk)
+                chunk, chunk_bytes = [], 0
+        if chunk:
+            flush(key, chunk)
+
+    # Журнал фиксирует замену; с этого момента она будет доведена до конца
+    journal_path = os.path.join(directory, f"{JOURNAL_PREFIX}{day}.json")
+    with open(journal_path + TMP_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump({"outputs": outputs, "inputs": names}, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(journal_path + TMP_SUFFIX, journal_path)
+
+    for tmp, final in outputs:
+        os.replace(os.path.join(directory, tmp), os.path.join(directory, final))
+    for name in names:
+        os.remove(os.path.join(directory, name))
+    os.remove(journal_path)
+
+    print(f"✅ {day}: {len(names)} файлов -> {len(outputs)}")
+    return len(names)
+
+
+def apply_retention(directory, retention_days, dry_run=False):
+    """Удаляет файлы данных, дата в имени которых старше retention_days"""
+    cutoff = (datetime.now() - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+    removed = 0
+    for name in sorted(os.listdir(directory)):
+        match = RETENTION_RE.match(name)
+        if match and match.group(1) < cutoff:
+            if dry_run:
+                print(f"🔍 Будет удалён по сроку хранения: {name}")
+            else:
+                os.remove(os.path.join(directory, name))
+            removed += 1
+    if removed and not dry_run:
+        print(f"🗑️ Удалено по сроку хранения ({retention_days} дн.): {removed} файлов")
+    return removed
+
+
+def compact(directory=".", target_size_mb=64, min_age=60, retention_days=None,
+            parquet_options=None, dry_run=False):
+    """Полный проход: восстановление, срок хранения, компактизация по дням"""
+    if not dry_run:
+        recover(directory)
+    if retention_days is not None:
+        with stage("retention"):
+            apply_retention(directory, retention_days, dry_run)
+
+    target_bytes = int(target_size_mb * 1024 * 1024)
+    candidates = find_candidates(directory, target_bytes, min_age)
+    total = 0
+    for day, names in sorted(candidates.items()):
+        with stage("compaction", day=day) as m:
+            for name in names:
+                m.add_file(os.path.join(directory, name))
+            total += compact_day(directory, day, names, target_bytes, parquet_options, dry_run)
+    if not total:
+        print("ℹ️ Нечего компактизировать")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Компактизация мелких Parquet файлов и срок хранения")
+    parser.add_argument("--dir", default=".", help="Каталог с файлами (по умолчанию текущий)")
+    parser.add_argument("--target-size-mb", type=float, default=64, help="Целевой размер файла, МБ")
+    parser.add_argument("--min-age", type=int, default=60,
+                        help="Не трогать файлы моложе стольких секунд")
+    parser.add_argument("--retention-days", type=int, help="Удалять данные старше N дней")
+    parser.add_argument("--compression", help="Кодек Parquet для результатов (snappy, zstd, ...)")
+    parser.add_argument("--compression-level", type=int, help="Уровень сжатия")
+    parser.add_argument("--dry-run", action="store_true", help="Только показать, что будет сделано")
+    args = parser.parse_args()
+
+    compact(args.dir, args.target_size_mb, args.min_age, args.retention_days,
+            {"compression": args.compression, "compression_level": args.compression_level},
+            args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,20 @@
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
 import uuid
 import json
 import random
 import os
-import boto3
-from botocore.config import Config
-from dotenv import load_dotenv
-
-# Загружаем переменные окружения
-load_dotenv()
-
-# Получаем параметры из .env
-OBS_ACCESS_KEY = os.getenv("OBS_ACCESS_KEY")
-OBS_SECRET_KEY = os.getenv("OBS_SECRET_KEY")
-OBS_REGION = os.getenv("OBS_REGION")
-OBS_ENDPOINT = os.getenv("OBS_ENDPOINT")
-OBS_BUCKET = os.getenv("OBS_BUCKET")
-
-# Проверка обязательных переменных
-required_vars = {
-    "OBS_ACCESS_KEY": OBS_ACCESS_KEY,
-    "OBS_SECRET_KEY": OBS_SECRET_KEY,
-    "OBS_REGION": OBS_REGION,
-    "OBS_ENDPOINT": OBS_ENDPOINT,
-    "OBS_BUCKET": OBS_BUCKET,
-}
-
-for name, value in required_vars.items():
-    if not value:
-        raise EnvironmentError(f"Переменная окружения {name} не задана в .env файле")
+from cloud_settings import get_obs_settings
+from metrics import stage
+from storage import arrow_path_for, write_arrow, write_parquet
+
+# pandas, boto3 и openpyxl импортируются внутри функций: генерация без
+# загрузки в облако не платит за импорт SDK и не требует учётных данных.
 
 def upload_to_cloud(filepath):
+    """Загрузка с повторами; крупные файлы — multipart с возобновлением"""
+    from cloud_upload import make_s3_client, resumable_upload
+
+    obs = get_obs_settings()
     object_name = os.path.basename(filepath)
     
     # Определяем Content-Type
@@ -43,23 +25,16 @@ def upload_to_cloud(filepath):
     else:
         content_type = 'application/octet-stream'
     
-    s3_params = {
-        "service_name": "s3",
-        "aws_access_key_id": OBS_ACCESS_KEY,
-        "aws_secret_access_key": OBS_SECRET_KEY,
-        "region_name": OBS_REGION,
-        "endpoint_url": OBS_ENDPOINT,
-        "config": Config(s3={"addressing_style": "virtual"})
-    }
-
     try:
-        s3_client = boto3.client(**s3_params)
-        s3_client.upload_file(
-            Filename=filepath,
-            Bucket=OBS_BUCKET,
-            Key=object_name,
-            ExtraArgs={'ContentType': content_type}
-        )
+        with stage("upload", file=object_name) as m:
+            s3_client = make_s3_client()
+            m.add_bytes(resumable_upload(
+                filepath,
+                object_name,
+                client=s3_client,
+                bucket=obs["OBS_BUCKET"],
+                content_type=content_type
+            ))
         print(f"✅ Загружено: {object_name} (Content-Type: {content_type})")
     except Exception as e:
         print(f"❌ Ошибка загрузки {filepath}: {e}")
@@ -155,16 +130,25 @@ def get_next_file_number(base_name="test1", extension="xlsx"):
     return max(numbers) + 1 if numbers else 1
 
 
-def create_data_files(num_rows=10, upload_enabled=True):
-    """Создаёт Excel и Parquet файлы и (опционально) загружает их в облако"""
+def create_data_files(num_rows=10, upload_enabled=True, parquet_options=None):
+    """Создаёт Excel и Parquet файлы и (опционально) загружает их в облако
+
+    parquet_options — параметры сжатия/кодирования для storage.write_parquet
+    """
+    import pandas as pd
+
+    # Учётные данные проверяем до генерации, только если нужна загрузка
+    if upload_enabled:
+        get_obs_settings()
     
     today = datetime.now().strftime("%Y-%m-%d")
     symbols = ['CNY/RUB', 'USD/RUB', 'EUR/RUB', 'INR/RUB']
 
     for symbol in symbols:
         file_number = get_next_file_number()
-        data = generate_random_data(num_rows, symbol)
-        df = pd.DataFrame(data)
+        with stage("generate", rows=num_rows, symbol=symbol):
+            data = generate_random_data(num_rows, symbol)
+            df = pd.DataFrame(data)
         df.columns = ['time', 'ulid', 'symbol', 'state', 'tenor', 'valueDateNear', 
                       'globalTradable', 'globalIndicative', 'rateId', 'tier', 'priceLevels']
 
@@ -172,19 +156,22 @@ def create_data_files(num_rows=10, upload_enabled=True):
         parquet_filename = f"database_{today}_{file_number}.parquet"
 
         # Сохраняем Excel
-        with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='sheet1', index=False)
-            workbook = writer.book
-            worksheet = writer.sheets['sheet1']
-            column_widths = {
-                'A': 20, 'B': 30, 'C': 12, 'D': 8, 'E': 8, 'F': 20,
-                'G': 15, 'H': 18, 'I': 15, 'J': 10, 'K': 50
-            }
-            for col, width in column_widths.items():
-                worksheet.column_dimensions[col].width = width
+        with stage("excel_write", rows=len(df), file=excel_filename) as m:
+            with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
+                df.to_excel(writer, sheet_name='sheet1', index=False)
+                workbook = writer.book
+                worksheet = writer.sheets['sheet1']
+                column_widths = {
+                    'A': 20, 'B': 30, 'C': 12, 'D': 8, 'E': 8, 'F': 20,
+                    'G': 15, 'H': 18, 'I': 15, 'J': 10, 'K': 50
+                }
+                for col, width in column_widths.items():
+                    worksheet.column_dimensions[col].width = width
+            m.add_file(excel_filename)
 
         # Сохраняем Parquet
-        df.to_parquet(parquet_filename, index=False, engine='pyarrow')
+        with stage("parquet_write", rows=len(df), file=parquet_filename) as m:
+            m.add_bytes(write_parquet(df, parquet_filename, **(parquet_options or {})))
 
         print(f"✅ Excel файл '{excel_filename}' создан с {num_rows} строками")
         print(f"✅ Parquet файл '{parquet_filename}' создан")
@@ -197,29 +184,46 @@ def create_data_files(num_rows=10, upload_enabled=True):
     return excel_filename, parquet_filename, df
 
 
-def create_consolidated_database(upload_enabled=True):
-    """Создаёт консолидированную Parquet-базу из всех database_*.parquet файлов"""
-    parquet_files = [f for f in os.listdir('.') if f.startswith('database_') and f.endswith('.parquet')]
+def create_consolidated_database(upload_enabled=True, parquet_options=None, arrow_output=False):
+    """Создаёт консолидированную Parquet-базу из всех database_*.parquet файлов
+
+    arrow_output — дополнительно записать рядом Arrow IPC копию для чтения через mmap
+    """
+    import pandas as pd
+    from ingest_watcher import data_files
+
+    if upload_enabled:
+        get_obs_settings()
+
+    parquet_files = data_files('.')
     
     if not parquet_files:
         print("❌ Parquet файлы не найдены для консолидации")
         return None
     
-    all_data = []
-    for file in parquet_files:
-        try:
-            df = pd.read_parquet(file)
-            df['source_file'] = file
-            all_data.append(df)
-        except Exception as e:
-            print(f"❌ Ошибка при чтении файла {file}: {e}")
+    with stage("consolidate", files=len(parquet_files)) as m:
+        all_data = []
+        for file in parquet_files:
+            try:
+                df = pd.read_parquet(file)
+                df['source_file'] = file
+                all_data.append(df)
+            except Exception as e:
+                print(f"❌ Ошибка при чтении файла {file}: {e}")
+        
+        if all_data:
+            consolidated_df = pd.concat(all_data, ignore_index=True)
+            consolidated_filename = f"consolidated_database_{datetime.now().strftime('%Y-%m-%d')}.parquet"
+            m.add_bytes(write_parquet(consolidated_df, consolidated_filename, **(parquet_options or {})))
+            m.add_rows(len(consolidated_df))
+            if arrow_output:
+                m.add_bytes(write_arrow(consolidated_df, arrow_path_for(consolidated_filename)))
     
     if all_data:
-        consolidated_df = pd.concat(all_data, ignore_index=True)
-        consolidated_filename = f"consolidated_database_{datetime.now().strftime('%Y-%m-%d')}.parquet"
-        consolidated_df.to_parquet(consolidated_filename, index=False, engine='pyarrow')
         print(f"✅ Консолидированная база данных '{consolidated_filename}' создана")
         print(f"   Объединено {len(parquet_files)} файлов, всего {len(consolidated_df)} записей")
+        if arrow_output:
+            print(f"✅ Arrow IPC копия '{arrow_path_for(consolidated_filename)}' создана")
         
         if upload_enabled:
             upload_to_cloud(consolidated_filename)
@@ -232,8 +236,13 @@ def create_consolidated_database(upload_enabled=True):
 
 def read_and_display_parquet(filename):
     """Читает и отображает данные из Parquet файла"""
+    import pandas as pd
+
     try:
-        df = pd.read_parquet(filename)
+        with stage("read_back", file=filename) as m:
+            df = pd.read_parquet(filename)
+            m.add_rows(len(df))
+            m.add_file(filename)
         print(f"\n📊 Данные из {filename}:")
         print(f"   Количество записей: {len(df)}")
         print(f"   Колонки: {list(df.columns)}")
@@ -1,43 +1,24 @@
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
 import uuid
 import json
 import random
 import os
 import asyncio
-from dotenv import load_dotenv
+from cloud_settings import get_obs_settings
+from metrics import stage
+from storage import arrow_path_for, write_arrow, write_parquet
 
-# Асинхронный S3-клиент
-import os
-from aiobotocore.session import AioSession
-from aiobotocore.config import AioConfig
-
-# Загружаем .env
-load_dotenv()
-
-# Параметры из окружения
-OBS_ACCESS_KEY = os.getenv("OBS_ACCESS_KEY")
-OBS_SECRET_KEY = os.getenv("OBS_SECRET_KEY")
-OBS_REGION = os.getenv("OBS_REGION")
-OBS_ENDPOINT = os.getenv("OBS_ENDPOINT")
-OBS_BUCKET = os.getenv("OBS_BUCKET")
-
-required_vars = {
-    "OBS_ACCESS_KEY": OBS_ACCESS_KEY,
-    "OBS_SECRET_KEY": OBS_SECRET_KEY,
-    "OBS_REGION": OBS_REGION,
-    "OBS_ENDPOINT": OBS_ENDPOINT,
-    "OBS_BUCKET": OBS_BUCKET,
-}
-
-for name, value in required_vars.items():
-    if not value:
-        raise EnvironmentError(f"Переменная окружения {name} не задана")
+# pandas и aiobotocore импортируются внутри функций, а учётные данные
+# проверяются только перед загрузкой в облако.
 
 
 async def upload_to_cloud_async(filepath: str):
     """Асинхронная загрузка файла в S3-совместимое облако с aiobotocore (v2+)"""
+    from aiobotocore.session import AioSession
+    from aiobotocore.config import AioConfig
+    from cloud_upload import resumable_upload_async
+
+    obs = get_obs_settings()
     object_name = os.path.basename(filepath)
 
     # Определяем Content-Type
@@ -54,21 +35,22 @@ async def upload_to_cloud_async(filepath: str):
 
     async with session.create_client(
         's3',
-        region_name=OBS_REGION,
-        endpoint_url=OBS_ENDPOINT,
-        aws_access_key_id=OBS_ACCESS_KEY,
-        aws_secret_access_key=OBS_SECRET_KEY,
+        region_name=obs["OBS_REGION"],
+        endpoint_url=obs["OBS_ENDPOINT"],
+        aws_access_key_id=obs["OBS_ACCESS_KEY"],
+        aws_secret_access_key=obs["OBS_SECRET_KEY"],
         config=config
     ) as client:
         try:
-            # ИСПРАВЛЕНИЕ: Используем асинхронную загрузку файла
-            with open(filepath, 'rb') as f:
-                await client.put_object(
-                    Bucket=OBS_BUCKET,
-                    Key=object_name,
-                    Body=f,  # Передаем файловый объект, а не прочитанные данные
-                    ContentType=content_type
-                )
+            # Повторы при сбоях; крупные файлы — multipart с возобновлением
+            with stage("upload", file=object_name) as m:
+                m.add_bytes(await resumable_upload_async(
+                    client,
+                    filepath,
+                    obs["OBS_BUCKET"],
+                    object_name,
+                    content_type=content_type
+                ))
             print(f"✅ Загружено: {object_name}")
         except Exception as e:
             print(f"❌ Ошибка загрузки {filepath}: {e}")
@@ -135,13 +117,19 @@ def get_next_file_number(base_name="Book1", extension="xlsx"):
     return max(numbers) + 1 if numbers else 1
 
 
-def create_data_files_sync(num_rows=10):
-    """Создаёт файлы синхронно (Excel/Parquet), возвращает имена"""
+def create_data_files_sync(num_rows=10, parquet_options=None):
+    """Создаёт файлы синхронно (Excel/Parquet), возвращает имена
+
+    parquet_options — параметры сжатия/кодирования для storage.write_parquet
+    """
+    import pandas as pd
+
     file_number = get_next_file_number()
     today = datetime.now().strftime("%Y-%m-%d")
     
-    data = generate_random_data(num_rows)
-    df = pd.DataFrame(data)
+    with stage("generate", rows=num_rows):
+        data = generate_random_data(num_rows)
+        df = pd.DataFrame(data)
     df.columns = ['time', 'ulid', 'symbol', 'state', 'tenor', 'valueDateNear',
                   'globalTradable', 'globalIndicative', 'rateId', 'tier', 'priceLevels']
     
@@ -149,45 +137,61 @@ def create_data_files_sync(num_rows=10):
     parquet_filename = f"database_{today}_{file_number}.parquet"
     
     # Excel
-    with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Sheet1', index=False)
-        ws = writer.sheets['Sheet1']
-        widths = {'A':20,'B':30,'C':12,'D':8,'E':8,'F':20,'G':15,'H':18,'I':15,'J':10,'K':50}
-        for col, w in widths.items():
-            ws.column_dimensions[col].width = w
+    with stage("excel_write", rows=len(df), file=excel_filename) as m:
+        with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
+            df.to_excel(writer, sheet_name='Sheet1', index=False)
+            ws = writer.sheets['Sheet1']
+            widths = {'A':20,'B':30,'C':12,'D':8,'E':8,'F':20,'G':15,'H':18,'I':15,'J':10,'K':50}
+            for col, w in widths.items():
+                ws.column_dimensions[col].width = w
+        m.add_file(excel_filename)
 
     # Parquet
-    df.to_parquet(parquet_filename, index=False, engine='pyarrow')
+    with stage("parquet_write", rows=len(df), file=parquet_filename) as m:
+        m.add_bytes(write_parquet(df, parquet_filename, **(parquet_options or {})))
     
     print(f"✅ Созданы файлы: {excel_filename}, {parquet_filename}")
     return excel_filename, parquet_filename, df
 
 
-def create_consolidated_database_sync():
-    parquet_files = [f for f in os.listdir('.') if f.startswith('database_') and f.endswith('.parquet')]
+def create_consolidated_database_sync(parquet_options=None, arrow_output=False):
+    """Консолидация database_*.parquet; arrow_output — ещё и Arrow IPC копия для mmap"""
+    import pandas as pd
+    from ingest_watcher import data_files
+
+    parquet_files = data_files('.')
     if not parquet_files:
         print("❌ Нет Parquet-файлов для консолидации")
         return None
-    all_dfs = []
-    for f in parquet_files:
-        try:
-            df = pd.read_parquet(f)
-            df['source_file'] = f
-            all_dfs.append(df)
-        except Exception as e:
-            print(f"❌ Ошибка чтения {f}: {e}")
-    if not all_dfs:
-        return None
-    consolidated = pd.concat(all_dfs, ignore_index=True)
-    cons_filename = f"consolidated_database_{datetime.now().strftime('%Y-%m-%d')}.parquet"
-    consolidated.to_parquet(cons_filename, index=False)
+    with stage("consolidate", files=len(parquet_files)) as m:
+        all_dfs = []
+        for f in parquet_files:
+            try:
+                df = pd.read_parquet(f)
+                df['source_file'] = f
+                all_dfs.append(df)
+            except Exception as e:
+                print(f"❌ Ошибка чтения {f}: {e}")
+        if not all_dfs:
+            return None
+        consolidated = pd.concat(all_dfs, ignore_index=True)
+        cons_filename = f"consolidated_database_{datetime.now().strftime('%Y-%m-%d')}.parquet"
+        m.add_bytes(write_parquet(consolidated, cons_filename, **(parquet_options or {})))
+        m.add_rows(len(consolidated))
+        if arrow_output:
+            m.add_bytes(write_arrow(consolidated, arrow_path_for(cons_filename)))
     print(f"✅ Консолидированная БД: {cons_filename}")
+    if arrow_output:
+        print(f"✅ Arrow IPC копия: {arrow_path_for(cons_filename)}")
     return cons_filename
 
 
 # --- Асинхронная основная функция ---
 
 async def main():
+    # 0. Проверка учётных данных до генерации
+    get_obs_settings()
+
     # 1. Генерация данных
     excel_file, parquet_file, _ = create_data_files_sync(num_rows=150)
     
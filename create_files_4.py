@@ -1,5 +1,3 @@
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
 import uuid
 import json
@@ -7,37 +5,18 @@ import random
 import os
 import time
 import asyncio
-from dotenv import load_dotenv
-import boto3
-from botocore.config import Config
-from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from cloud_settings import get_obs_settings
+from metrics import stage
+from storage import arrow_path_for, write_arrow, write_parquet
 
-# Загружаем .env
-load_dotenv()
-
-# Параметры из окружения
-OBS_ACCESS_KEY = os.getenv("OBS_ACCESS_KEY")
-OBS_SECRET_KEY = os.getenv("OBS_SECRET_KEY")
-OBS_REGION = os.getenv("OBS_REGION")
-OBS_ENDPOINT = os.getenv("OBS_ENDPOINT")
-OBS_BUCKET = os.getenv("OBS_BUCKET")
-
-required_vars = {
-    "OBS_ACCESS_KEY": OBS_ACCESS_KEY,
-    "OBS_SECRET_KEY": OBS_SECRET_KEY,
-    "OBS_REGION": OBS_REGION,
-    "OBS_ENDPOINT": OBS_ENDPOINT,
-    "OBS_BUCKET": OBS_BUCKET,
-}
-
-for name, value in required_vars.items():
-    if not value:
-        raise EnvironmentError(f"Переменная окружения {name} не задана")
+# pandas, openpyxl и boto3 импортируются внутри функций, а учётные данные
+# проверяются только перед загрузкой в облако.
 
 
 def create_excel_with_retry(df, filename, max_retries=3):
     """Создает Excel файл с повторными попытками"""
+    from openpyxl import Workbook
+
     for attempt in range(max_retries):
         try:
             # Создаем временный файл
@@ -101,7 +80,11 @@ def create_excel_with_retry(df, filename, max_retries=3):
 
 
 def upload_to_cloud_sync(filepath: str):
-    """Синхронная загрузка файла в S3-совместимое облако"""
+    """Синхронная загрузка файла в S3-совместимое облако (с повторами и возобновлением)"""
+    from cloud_upload import make_s3_client, resumable_upload
+
+    obs = get_obs_settings()
+
     if not os.path.exists(filepath):
         print(f"❌ Файл не существует: {filepath}")
         return False
@@ -124,26 +107,18 @@ def upload_to_cloud_sync(filepath: str):
         content_type = 'application/octet-stream'
 
     # Создаем клиент
-    session = boto3.session.Session()
-    config = Config(s3={'addressing_style': 'virtual'})
-
-    client = session.client(
-        's3',
-        region_name=OBS_REGION,
-        endpoint_url=OBS_ENDPOINT,
-        aws_access_key_id=OBS_ACCESS_KEY,
-        aws_secret_access_key=OBS_SECRET_KEY,
-        config=config
-    )
+    client = make_s3_client()
 
     try:
-        # Используем upload_file вместо put_object
-        client.upload_file(
-            filepath,
-            OBS_BUCKET,
-            object_name,
-            ExtraArgs={'ContentType': content_type}
-        )
+        # Повторы при сбоях; крупные файлы — multipart с контрольными точками
+        with stage("upload", file=object_name) as m:
+            m.add_bytes(resumable_upload(
+                filepath,
+                object_name,
+                client=client,
+                bucket=obs["OBS_BUCKET"],
+                content_type=content_type
+            ))
         print(f"✅ Успешно загружено: {object_name}")
         return True
         
@@ -211,13 +186,19 @@ def get_next_file_number(base_name="Book1", extension="xlsx"):
     return max(numbers) + 1 if numbers else 1
 
 
-def create_data_files_sync(num_rows=10):
-    """Создаёт файлы синхронно (Excel/Parquet), возвращает имена"""
+def create_data_files_sync(num_rows=10, parquet_options=None):
+    """Создаёт файлы синхронно (Excel/Parquet), возвращает имена
+
+    parquet_options — параметры сжатия/кодирования для storage.write_parquet
+    """
+    import pandas as pd
+
     file_number = get_next_file_number()
     today = datetime.now().strftime("%Y-%m-%d")
     
-    data = generate_random_data(num_rows)
-    df = pd.DataFrame(data)
+    with stage("generate", rows=num_rows):
+        data = generate_random_data(num_rows)
+        df = pd.DataFrame(data)
     df.columns = ['time', 'ulid', 'symbol', 'state', 'tenor', 'valueDateNear',
                   'globalTradable', 'globalIndicative', 'rateId', 'tier', 'priceLevels']
     
@@ -225,13 +206,19 @@ def create_data_files_sync(num_rows=10):
     parquet_filename = f"database_{today}_{file_number}.parquet"
     
     # Создаем Excel с повторными попытками
-    if not create_excel_with_retry(df, excel_filename):
+    with stage("excel_write", rows=len(df), file=excel_filename) as m:
+        excel_created = create_excel_with_retry(df, excel_filename)
+        m.add_file(excel_filename)
+    if not excel_created:
         print("❌ Не удалось создать Excel файл после нескольких попыток")
         return None, None, None
     
     # Проверяем что Excel открывается локально
     try:
-        test_df = pd.read_excel(excel_filename, engine='openpyxl')
+        with stage("read_back", file=excel_filename) as m:
+            test_df = pd.read_excel(excel_filename, engine='openpyxl')
+            m.add_rows(len(test_df))
+            m.add_file(excel_filename)
         print(f"✅ Локальная проверка Excel: {len(test_df)} строк")
     except Exception as e:
         print(f"❌ Локальный Excel файл не открывается: {e}")
@@ -239,8 +226,9 @@ def create_data_files_sync(num_rows=10):
     
     # Parquet
     try:
-        df.to_parquet(parquet_filename, index=False, engine='pyarrow')
-        parquet_size = os.path.getsize(parquet_filename)
+        with stage("parquet_write", rows=len(df), file=parquet_filename) as m:
+            parquet_size = write_parquet(df, parquet_filename, **(parquet_options or {}))
+            m.add_bytes(parquet_size)
         print(f"✅ Parquet файл создан: {parquet_filename} ({parquet_size} байт)")
     except Exception as e:
         print(f"❌ Ошибка создания Parquet: {e}")
@@ -249,30 +237,43 @@ def create_data_files_sync(num_rows=10):
     return excel_filename, parquet_filename, df
 
 
-def create_consolidated_database_sync():
-    parquet_files = [f for f in os.listdir('.') if f.startswith('database_') and f.endswith('.parquet')]
+def create_consolidated_database_sync(parquet_options=None, arrow_output=False):
+    """Консолидация database_*.parquet; arrow_output — ещё и Arrow IPC копия для mmap"""
+    import pandas as pd
+    from ingest_watcher import data_files
+
+    parquet_files = data_files('.')
     if not parquet_files:
         print("❌ Нет Parquet-файлов для консолидации")
         return None
-    all_dfs = []
-    for f in parquet_files:
-        try:
-            df = pd.read_parquet(f)
-            df['source_file'] = f
-            all_dfs.append(df)
-        except Exception as e:
-            print(f"❌ Ошибка чтения {f}: {e}")
-    if not all_dfs:
-        return None
-    consolidated = pd.concat(all_dfs, ignore_index=True)
-    cons_filename = f"consolidated_database_{datetime.now().strftime('%Y-%m-%d')}.parquet"
-    consolidated.to_parquet(cons_filename, index=False)
+    with stage("consolidate", files=len(parquet_files)) as m:
+        all_dfs = []
+        for f in parquet_files:
+            try:
+                df = pd.read_parquet(f)
+                df['source_file'] = f
+                all_dfs.append(df)
+            except Exception as e:
+                print(f"❌ Ошибка чтения {f}: {e}")
+        if not all_dfs:
+            return None
+        consolidated = pd.concat(all_dfs, ignore_index=True)
+        cons_filename = f"consolidated_database_{datetime.now().strftime('%Y-%m-%d')}.parquet"
+        m.add_bytes(write_parquet(consolidated, cons_filename, **(parquet_options or {})))
+        m.add_rows(len(consolidated))
+        if arrow_output:
+            m.add_bytes(write_arrow(consolidated, arrow_path_for(cons_filename)))
     print(f"✅ Консолидированная БД: {cons_filename}")
+    if arrow_output:
+        print(f"✅ Arrow IPC копия: {arrow_path_for(cons_filename)}")
     return cons_filename
 
 
 async def main():
     print("🚀 Начало процесса генерации и загрузки данных...")
+
+    # Учётные данные проверяем до генерации: без них загрузка всё равно невозможна
+    get_obs_settings()
     
     # 1. Генерация данных
     print("📊 Генерация данных...")
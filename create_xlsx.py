@@ -1,10 +1,10 @@
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
 import uuid
 import json
 import random
 import os
+from metrics import stage
+from storage import arrow_path_for, write_arrow, write_parquet
 
 def generate_random_data(num_rows=10):
     """Генерирует случайные данные в указанном формате"""
@@ -99,18 +99,24 @@ def get_next_file_number(base_name="Книга1", extension="xlsx"):
     
     return max(numbers) + 1 if numbers else 1
 
-def create_data_files(num_rows=10):
-    """Создает Excel файл и Parquet базу данных с текущей датой и номером"""
+def create_data_files(num_rows=10, parquet_options=None):
+    """Создает Excel файл и Parquet базу данных с текущей датой и номером
+
+    parquet_options — параметры сжатия/кодирования для storage.write_parquet
+    """
+    import pandas as pd
+
     
     # Получаем следующий номер файла
     file_number = get_next_file_number()
     today = datetime.now().strftime("%Y-%m-%d")
     
     # Генерируем данные
-    data = generate_random_data(num_rows)
-    
-    # Создаем DataFrame
-    df = pd.DataFrame(data)
+    with stage("generate", rows=num_rows):
+        data = generate_random_data(num_rows)
+        
+        # Создаем DataFrame
+        df = pd.DataFrame(data)
     
     # Переименовываем колонки для соответствия исходному формату
     df.columns = ['time', 'ulid', 'symbol', 'state', 'tenor', 'valueDateNear', 
@@ -121,62 +127,80 @@ def create_data_files(num_rows=10):
     parquet_filename = f"database_{today}_{file_number}.parquet"
     
     # Сохраняем в Excel
-    with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Лист1', index=False)
+    with stage("excel_write", rows=len(df), file=excel_filename) as m:
+        with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
+            df.to_excel(writer, sheet_name='Лист1', index=False)
         
-        # Получаем workbook и worksheet для настройки
-        workbook = writer.book
-        worksheet = writer.sheets['Лист1']
+            # Получаем workbook и worksheet для настройки
+            workbook = writer.book
+            worksheet = writer.sheets['Лист1']
         
-        # Настраиваем ширину колонок для лучшего отображения
-        column_widths = {
-            'A': 20,  # time
-            'B': 30,  # ulid
-            'C': 12,  # symbol
-            'D': 8,   # state
-            'E': 8,   # tenor
-            'F': 20,  # valueDateNear
-            'G': 15,  # globalTradable
-            'H': 18,  # globalIndicative
-            'I': 15,  # rateId
-            'J': 10,  # tier
-            'K': 50   # priceLevels
-        }
+            # Настраиваем ширину колонок для лучшего отображения
+            column_widths = {
+                'A': 20,  # time
+                'B': 30,  # ulid
+                'C': 12,  # symbol
+                'D': 8,   # state
+                'E': 8,   # tenor
+                'F': 20,  # valueDateNear
+                'G': 15,  # globalTradable
+                'H': 18,  # globalIndicative
+                'I': 15,  # rateId
+                'J': 10,  # tier
+                'K': 50   # priceLevels
+            }
         
-        for col, width in column_widths.items():
-            worksheet.column_dimensions[col].width = width
+            for col, width in column_widths.items():
+                worksheet.column_dimensions[col].width = width
+    
+        m.add_file(excel_filename)
     
     # Сохраняем в Parquet
-    df.to_parquet(parquet_filename, index=False, engine='pyarrow')
+    with stage("parquet_write", rows=len(df), file=parquet_filename) as m:
+        m.add_bytes(write_parquet(df, parquet_filename, **(parquet_options or {})))
     
     print(f"✅ Excel файл '{excel_filename}' успешно создан с {num_rows} строками данных")
     print(f"✅ Parquet база данных '{parquet_filename}' успешно создана")
     
     return excel_filename, parquet_filename, df
 
-def create_consolidated_database():
-    """Создает консолидированную базу данных из всех Parquet файлов"""
-    parquet_files = [f for f in os.listdir('.') if f.startswith('database_') and f.endswith('.parquet')]
+def create_consolidated_database(parquet_options=None, arrow_output=False):
+    """Создает консолидированную базу данных из всех Parquet файлов
+
+    arrow_output — дополнительно записать рядом Arrow IPC копию для чтения через mmap
+    """
+    import pandas as pd
+    from ingest_watcher import data_files
+
+    parquet_files = data_files('.')
     
     if not parquet_files:
         print("❌ Parquet файлы не найдены для консолидации")
         return None
     
-    all_data = []
-    for file in parquet_files:
-        try:
-            df = pd.read_parquet(file)
-            df['source_file'] = file  # Добавляем информацию о источнике
-            all_data.append(df)
-        except Exception as e:
-            print(f"❌ Ошибка при чтении файла {file}: {e}")
+    with stage("consolidate", files=len(parquet_files)) as m:
+        all_data = []
+        for file in parquet_files:
+            try:
+                df = pd.read_parquet(file)
+                df['source_file'] = file  # Добавляем информацию о источнике
+                all_data.append(df)
+            except Exception as e:
+                print(f"❌ Ошибка при чтении файла {file}: {e}")
+        
+        if all_data:
+            consolidated_df = pd.concat(all_data, ignore_index=True)
+            consolidated_filename = f"consolidated_database_{datetime.now().strftime('%Y-%m-%d')}.parquet"
+            m.add_bytes(write_parquet(consolidated_df, consolidated_filename, **(parquet_options or {})))
+            m.add_rows(len(consolidated_df))
+            if arrow_output:
+                m.add_bytes(write_arrow(consolidated_df, arrow_path_for(consolidated_filename)))
     
     if all_data:
-        consolidated_df = pd.concat(all_data, ignore_index=True)
-        consolidated_filename = f"consolidated_database_{datetime.now().strftime('%Y-%m-%d')}.parquet"
-        consolidated_df.to_parquet(consolidated_filename, index=False, engine='pyarrow')
         print(f"✅ Консолидированная база данных '{consolidated_filename}' создана")
         print(f"   Объединено {len(parquet_files)} файлов, всего {len(consolidated_df)} записей")
+        if arrow_output:
+            print(f"✅ Arrow IPC копия '{arrow_path_for(consolidated_filename)}' создана")
         return consolidated_filename
     else:
         print("❌ Не удалось создать консолидированную базу данных")
@@ -184,8 +208,13 @@ def create_consolidated_database():
 
 def read_and_display_parquet(filename):
     """Читает и отображает данные из Parquet файла"""
+    import pandas as pd
+
     try:
-        df = pd.read_parquet(filename)
+        with stage("read_back", file=filename) as m:
+            df = pd.read_parquet(filename)
+            m.add_rows(len(df))
+            m.add_file(filename)
         print(f"\n📊 Данные из {filename}:")
         print(f"   Количество записей: {len(df)}")
         print(f"   Колонки: {list(df.columns)}")
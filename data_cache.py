@@ -0,0 +1,191 @@
+"""Кэширующий загрузчик Parquet для ноутбуков.
+
+Повторный запуск ячейки с load(...) не читает и не декодирует файл
+заново: результат берётся из памяти процесса, а после перезапуска ядра —
+из дискового кэша (Arrow IPC без сжатия, открывается через mmap,
+см. storage.read_arrow).
+
+Ключ кэша — путь, размер, mtime_ns файла, запрошенные колонки и фильтры,
+поэтому изменённый или перезаписанный файл прочитается заново. Кэш
+в памяти — LRU с ограничением по объёму таблиц; дисковый кэш тоже
+ограничен по объёму: сверх лимита удаляются давно не использованные
+копии (как в remote_parquet.trim_cache).
+
+    DATA_CACHE_MEMORY_MB  лимит кэша в памяти (по умолчанию 1024)
+    DATA_CACHE_DISK_MB    лимит дискового кэша (по умолчанию 2048)
+    DATA_CACHE_DIR        каталог дискового кэша (по умолчанию .data_cache,
+                          пустое значение — без дискового кэша)
+
+Пример в ноутбуке:
+
+    from data_cache import load_consolidated
+    df = load_consolidated(columns=["time", "symbol", "bid_price"],
+                           filters=[("symbol", "=", "USD/RUB")])
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import stage
+
+_memory = OrderedDict()
+_memory_bytes = 0
+_lock = threading.Lock()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def _memory_limit():
+    return int(os.getenv("DATA_CACHE_MEMORY_MB", "1024")) * 1024 * 1024
+
+
+def _disk_limit():
+    return int(os.getenv("DATA_CACHE_DISK_MB", "2048")) * 1024 * 1024
+
+
+def _cache_dir():
+    return os.getenv("DATA_CACHE_DIR", ".data_cache")
+
+
+def _cache_key(path, columns, filters):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+            tuple(columns) if columns is not None else None,
+            json.dumps(filters, default=str) if filters is not None else None)
+
+
+def _disk_path(key, cache_dir):
+    """<хэш пути>-<размер>-<mtime>-<хэш запроса>.arrow"""
+    path, size, mtime_ns, columns, filters = key
+    path_hash = hashlib.sha1(path.encode()).hexdigest()[:16]
+    query_hash = hashlib.sha1(repr((columns, filters)).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{path_hash}-{size}-{mtime_ns}-{query_hash}.arrow")
+
+
+def _remember(key, table):
+    global _memory_bytes
+    limit = _memory_limit()
+    if table.nbytes > limit:
+        return
+    with _lock:
+        if key in _memory:
+            _memory_bytes -= _memory.pop(key).nbytes
+        _memory[key] = table
+        _memory_bytes += table.nbytes
+        while _memory_bytes > limit:
+            _, evicted = _memory.popitem(last=False)
+            _memory_bytes -= evicted.nbytes
+
+
+def _store_on_disk(key, table, cache_dir):
+    from storage import write_arrow
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _disk_path(key, cache_dir)
+    # Удаляем записи для прежних версий того же файла
+    prefix = os.path.basename(path).split("-")[0]
+    version = "-".join(os.path.basename(path).split("-")[1:3])
+    for old in glob.glob(os.path.join(cache_dir, f"{prefix}-*.arrow")):
+        if "-".join(os.path.basename(old).split("-")[1:3]) != version:
+            os.remove(old)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    write_arrow(table, tmp_path)
+    os.replace(tmp_path, path)
+    trim_disk_cache(cache_dir)
+
+
+def trim_disk_cache(cache_dir=None, max_bytes=None):
+    """Удаляет давно не использованные копии, пока дисковый кэш больше max_bytes.
+
+    Уже открытые через mmap таблицы удаление не затрагивает.
+    """
+    from remote_parquet import trim_cache
+
+    cache_dir = cache_dir or _cache_dir()
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return 0
+    return trim_cache(cache_dir, _disk_limit() if max_bytes is None else max_bytes)
+
+
+def load_table(path, columns=None, filters=None):
+    """pyarrow.Table из Parquet файла с кэшированием в памяти и на диске.
+
+    filters — в формате pyarrow.parquet.read_table (например [("symbol", "=", "USD/RUB")]).
+    """
+    key = _cache_key(path, columns, filters)
+    with _lock:
+        table = _memory.get(key)
+        if table is not None:
+            _memory.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return table
+
+    cache_dir = _cache_dir()
+    disk_path = _disk_path(key, cache_dir) if cache_dir else None
+    table = None
+    if disk_path and os.path.exists(disk_path):
+        from storage import read_arrow
+
+        try:
+            table = read_arrow(disk_path)
+            # mtime — время последнего использования для trim_disk_cache
+            os.utime(disk_path)
+            _stats["disk_hits"] += 1
+        except FileNotFoundError:
+            # Копию только что вытеснил trim_disk_cache другого процесса
+            table = None
+    if table is None:
+        import pyarrow.parquet as pq
+
+        with stage("cache_load", file=os.path.basename(path)) as m:
+            table = pq.read_table(path, columns=columns, filters=filters)
+            m.add_rows(table.num_rows)
+            m.add_file(path)
+        _stats["misses"] += 1
+        if disk_path:
+            _store_on_disk(key, table, cache_dir)
+    _remember(key, table)
+    return table
+
+
+def load(path, columns=None, filters=None):
+    """То же, что load_table, но возвращает новый DataFrame.
+
+    Каждый вызов строит свой DataFrame, так что правки в ноутбуке
+    не портят закэшированные данные.
+    """
+    return load_table(path, columns, filters).to_pandas(split_blocks=True)
+
+
+def latest_consolidated(directory="."):
+    """Самый свежий consolidated_database_*.parquet в каталоге"""
+    files = sorted(glob.glob(os.path.join(directory, "consolidated_database_*.parquet")))
+    if not files:
+        raise FileNotFoundError(f"consolidated_database_*.parquet не найден в {directory}")
+    return files[-1]
+
+
+def load_consolidated(directory=".", columns=None, filters=None):
+    """DataFrame из самой свежей консолидированной базы"""
+    return load(latest_consolidated(directory), columns, filters)
+
+
+def cache_info():
+    """Статистика кэша: попадания, промахи, размер в памяти"""
+    with _lock:
+        return dict(_stats, entries=len(_memory), memory_bytes=_memory_bytes)
+
+
+def clear(disk=False):
+    """Очищает кэш в памяти и, при disk=True, дисковый кэш"""
+    global _memory_bytes
+    with _lock:
+        _memory.clear()
+        _memory_bytes = 0
+    cache_dir = _cache_dir()
+    if disk and cache_dir and os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name.endswith(".arrow"):
+                os.remove(os.path.join(cache_dir, name))
@@ -0,0 +1,294 @@
+"""Потоковая загрузка накопленных Excel-книг в Parquet.
+
+Книги в форматах этого проекта (Книга1_*.xlsx, Book1_*.xlsx,
+test1_*.xlsx, <дата>_*.xlsx) читаются через openpyxl в режиме
+read_only: строки идут потоком (iter_rows), без загрузки всей книги
+в память, и пачками по --batch-rows пишутся в Parquet через
+ParquetWriter в схеме проекта (см. SCHEMA).
+
+Колонки сопоставляются по заголовку первой строки листа, лишние
+игнорируются, недостающие заполняются null. Даты-ячейки (ручная
+правка в Excel) приводятся к строкам '%Y-%m-%dT%H:%M:%SZ', числа,
+сохранённые как текст, — к int64. Листы без колонок проекта пропускаются.
+
+Результат: database_<дата>_xlsx_<имя книги>.parquet — префикс database_
+нужен, чтобы файлы подхватили консолидация и агрегаты. Книги, для
+которых Parquet уже новее исходника, пропускаются. Книги
+обрабатываются параллельно в отдельных процессах.
+
+Генераторы (create_*.py) пишут вместе с каждой книгой
+<префикс>_<дата>_<N>.xlsx файл database_<дата>_<N>.parquet с теми же
+строками. Такие книги пропускаются, если их парный Parquet есть рядом
+или уже слит компактизацией, — иначе консолидация и агрегаты учли бы
+каждую строку дважды. По той же причине пропускаются книги, чей
+результат compaction.py уже слил в файлы по символам.
+
+Примеры:
+
+    python ingest_excel.py --dir . --jobs 8
+    python ingest_excel.py Book1_2025-10-13_1.xlsx --typed-prices
+"""
+import argparse
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+
+from metrics import absorb, run_captured, stage
+
+WORKBOOK_RE = re.compile(r"^(?:(?:Книга1|Book1|test1)_)?(\d{4}-\d{2}-\d{2})_(\d+)\.xlsx$")
+STRING_COLUMNS = ("time", "ulid", "symbol", "tenor", "valueDateNear", "tier", "priceLevels")
+INT_COLUMNS = ("state", "globalTradable", "globalIndicative", "rateId")
+COLUMNS = ("time", "ulid", "symbol", "state", "tenor", "valueDateNear",
+           "globalTradable", "globalIndicative", "rateId", "tier", "priceLevels")
+SOURCE_KEY = b"source_workbook"
+BATCH_ROWS = 50_000
+TMP_SUFFIX = ".ingesting"
+
+
+def schema(typed_prices=False):
+    """Схема database_*.parquet (как у файлов, записанных генераторами)"""
+    import pyarrow as pa
+    from price_levels import PRICE_COLUMNS
+
+    fields = [(name, pa.int64() if name in INT_COLUMNS else pa.string()) for name in COLUMNS]
+    if typed_prices:
+        fields = [f for f in fields if f[0] != "priceLevels"] + [(name, pa.int64()) for name in PRICE_COLUMNS]
+    return pa.schema(fields)
+
+
+def find_workbooks(directory="."):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if WORKBOOK_RE.match(name))
+
+
+def generated_twin(workbook):
+    """Имя database_<дата>_<N>.parquet, записанного генератором вместе с книгой"""
+    match = WORKBOOK_RE.match(os.path.basename(workbook))
+    return f"database_{match.group(1)}_{match.group(2)}.parquet" if match else None
+
+
+def _present(name, directory, day):
+    """Файл есть в каталоге сам или уже слит компактизацией в database_<день>_*_part*"""
+    import glob
+    from storage import compacted_sources
+
+    if os.path.exists(os.path.join(directory, name)):
+        return True
+    for compacted in glob.glob(os.path.join(directory, f"database_{day}_*_part*.parquet")):
+        try:
+            if name in compacted_sources(compacted):
+                return True
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать {compacted}: {e}")
+    return False
+
+
+def has_generated_twin(workbook, output_dir="."):
+    """True, если строки книги уже есть в парном Parquet генератора"""
+    twin = generated_twin(workbook)
+    if twin is None:
+        return False
+    day = WORKBOOK_RE.match(os.path.basename(workbook)).group(1)
+    return any(_present(twin, directory, day)
+               for directory in {os.path.dirname(workbook) or ".", output_dir})
+
+
+def already_compacted(workbook, output_dir="."):
+    """True, если результат книги уже слит compaction.py в файлы по символам"""
+    path = output_path(workbook, output_dir)
+    if os.path.exists(path):
+        return False
+    day = os.path.basename(path)[len("database_"):][:10]
+    return _present(os.path.basename(path), output_dir, day)
+
+
+def output_path(workbook, output_dir="."):
+    """Книга1_2025-10-13_1.xlsx -> database_2025-10-13_xlsx_Книга1_2025-10-13_1.parquet"""
+    name = os.path.basename(workbook)
+    match = WORKBOOK_RE.match(name)
+    if match:
+        day = match.group(1)
+    else:
+        day = datetime.fromtimestamp(os.path.getmtime(workbook)).strftime("%Y-%m-%d")
+    stem = os.path.splitext(name)[0]
+    return os.path.join(output_dir, f"database_{day}_xlsx_{stem}.parquet")
+
+
+def _to_string(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%dT00:00:00Z")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    text = str(value).strip()
+    return text or None
+
+
+def _to_int(value):
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return int(float(text.replace(",", ".")))
+
+
+def _header_positions(header):
+    """{колонка проекта: номер ячейки} по строке заголовка"""
+    positions = {}
+    for i, cell in enumerate(header or ()):
+        name = str(cell).strip() if cell is not None else ""
+        if name in COLUMNS and name not in positions:
+            positions[name] = i
+    return positions
+
+
+def _make_batch(rows, positions, target_schema):
+    import pyarrow as pa
+    from price_levels import PRICE_COLUMNS, parse_price_levels
+
+    arrays = {}
+    for name in COLUMNS:
+        i = positions.get(name)
+        values = [row[i] if i is not None and i < len(row) else None for row in rows]
+        convert = _to_int if name in INT_COLUMNS else _to_string
+        arrays[name] = pa.array([convert(v) for v in values],
+                                pa.int64() if name in INT_COLUMNS else pa.string())
+    if "bid_price" in target_schema.names:
+        prices = parse_price_levels(arrays.pop("priceLevels"))
+        for name in PRICE_COLUMNS:
+            arrays[name] = prices[name].combine_chunks()
+    return pa.RecordBatch.from_arrays([arrays[name] for name in target_schema.names], schema=target_schema)
+
+
+def ingest_workbook(workbook, output_dir=".", batch_rows=BATCH_ROWS, typed_prices=False,
+                    parquet_options=None, force=False):
+    """Конвертирует одну книгу; возвращает (путь, строк) или None, если пропущена"""
+    import openpyxl
+    import pyarrow.parquet as pq
+    from storage import parquet_write_kwargs
+
+    path = output_path(workbook, output_dir)
+    if not force and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(workbook):
+        return None
+
+    target_schema = schema(typed_prices).with_metadata({SOURCE_KEY: os.path.basename(workbook).encode()})
+    tmp_path = f"{path}{TMP_SUFFIX}"
+    total = 0
+    with stage("xlsx_ingest", file=os.path.basename(workbook)) as m:
+        book = openpyxl.load_workbook(workbook, read_only=True, data_only=True)
+        writer = None
+        try:
+            for sheet in book.worksheets:
+                rows = sheet.iter_rows(values_only=True)
+                positions = _header_positions(next(rows, None))
+                if "time" not in positions or "symbol" not in positions:
+                    print(f"⚠️ {workbook}: лист '{sheet.title}' без колонок проекта пропущен")
+                    continue
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, target_schema,
+                                              **parquet_write_kwargs(target_schema, **(parquet_options or {})))
+                batch = []
+                for row in rows:
+                    # Пустые строки в конце листа после ручной правки
+                    if not any(cell is not None for cell in row):
+                        continue
+                    batch.append(row)
+                    if len(batch) >= batch_rows:
+                        writer.write_batch(_make_batch(batch, positions, target_schema))
+                        total += len(batch)
+                        batch = []
+                if batch:
+                    writer.write_batch(_make_batch(batch, positions, target_schema))
+                    total += len(batch)
+            if writer is None:
+                return None
+            writer.close()
+            writer = None
+            os.replace(tmp_path, path)
+        finally:
+            book.close()
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        m.add_rows(total)
+        m.add_file(path)
+    return path, total
+
+
+def ingest(workbooks, output_dir=".", jobs=None, batch_rows=BATCH_ROWS, typed_prices=False,
+           parquet_options=None, force=False):
+    """Параллельно конвертирует книги; возвращает список созданных файлов"""
+    if not workbooks:
+        print("❌ Excel файлы не найдены")
+        return []
+    duplicates = [w for w in workbooks if has_generated_twin(w, output_dir)]
+    for workbook in duplicates:
+        print(f"ℹ️ {workbook}: строки уже есть в {generated_twin(workbook)}, книга пропущена")
+    compacted = [w for w in workbooks if w not in duplicates and already_compacted(w, output_dir)]
+    for workbook in compacted:
+        print(f"ℹ️ {workbook}: уже загружена и слита компактизацией, книга пропущена")
+    workbooks = [w for w in workbooks if w not in duplicates and w not in compacted]
+    if not workbooks:
+        return []
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(workbooks)))
+    created, skipped = [], 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(run_captured, ingest_workbook, workbook, output_dir, batch_rows, typed_prices,
+                        parquet_options, force): workbook
+            for workbook in workbooks
+        }
+        for future in as_completed(futures):
+            workbook = futures[future]
+            try:
+                result, records = future.result()
+                absorb(records)
+            except Exception as e:
+                print(f"❌ Ошибка при чтении файла {workbook}: {e}")
+                continue
+            if result is None:
+                skipped += 1
+                continue
+            path, rows = result
+            created.append(path)
+            print(f"✅ {workbook} -> {path} ({rows} строк)")
+    if skipped:
+        print(f"ℹ️ Пропущено книг: {skipped} (уже загружены или без данных)")
+    print(f"✅ Загружено книг: {len(created)} из {len(workbooks)}")
+    return created
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Потоковая загрузка Excel-книг в Parquet")
+    parser.add_argument("files", nargs="*", help="Книги (по умолчанию все подходящие .xlsx в --dir)")
+    parser.add_argument("--dir", default=".", help="Каталог с книгами")
+    parser.add_argument("--output-dir", default=".", help="Каталог для Parquet файлов")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Процессов")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="Строк в пачке записи")
+    parser.add_argument("--typed-prices", action="store_true",
+                        help="Сразу разложить priceLevels на bid/ask колонки (как migrate_price_levels.py)")
+    parser.add_argument("--compression", help="Кодек Parquet (snappy, zstd, ...)")
+    parser.add_argument("--compression-level", type=int, help="Уровень сжатия Parquet")
+    parser.add_argument("--force", action="store_true", help="Перезаписать уже загруженные книги")
+    args = parser.parse_args()
+
+    workbooks = args.files or find_workbooks(args.dir)
+    parquet_options = {"compression": args.compression, "compression_level": args.compression_level}
+    ingest(workbooks, args.output_dir, args.jobs, args.batch_rows, args.typed_prices,
+           parquet_options, args.force)
+
+
+if __name__ == "__main__":
+    main()
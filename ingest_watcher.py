@@ -0,0 +1,347 @@
+"""Непрерывный приём новых database_*.parquet файлов.
+
+Демон следит за каталогом и обрабатывает каждый новый файл сразу после
+того, как его закрыли на запись:
+
+    1. добавляет запись в индекс ingest_index.jsonl (строки, символы,
+       диапазон времени, размер) — это состояние самого демона: по нему
+       он знает, какие файлы уже приняты;
+    2. дописывает строки в инкрементальные агрегаты (rollups.py);
+    3. при --upload загружает файл в облако.
+
+На Linux используется inotify (IN_CLOSE_WRITE / IN_MOVED_TO) без
+сторонних зависимостей; на других системах или с --poll — опрос каталога:
+файл считается закрытым, когда его размер и mtime не меняются между
+двумя проходами. При переполнении очереди inotify (IN_Q_OVERFLOW)
+каталог пересканируется и индекс сверяется с ним.
+
+Пример:
+
+    python ingest_watcher.py --dir . --upload
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import signal
+import struct
+import time
+from datetime import datetime, timezone
+
+from metrics import stage
+
+INDEX_FILE = "ingest_index.jsonl"
+MAX_RETRY_DELAY = 60.0
+
+
+def is_data_file(name):
+    return name.startswith('database_') and name.endswith('.parquet')
+
+
+class InotifyWatcher:
+    """Наблюдение за каталогом через inotify (только Linux)"""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify недоступен")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_MOVED_FROM | self.IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch")
+
+    def wait(self, timeout):
+        """Список событий ("closed" | "deleted" | "overflow", имя файла) за время ожидания"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    # Часть событий потеряна ядром — нужен полный проход по каталогу
+                    events.append(("overflow", ""))
+                elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                    events.append(("closed", name))
+                elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    events.append(("deleted", name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Запасной вариант: опрос каталога с проверкой стабильности файла"""
+
+    def __init__(self, directory, interval=1.0):
+        self.directory = directory
+        self.interval = interval
+        self.known = self._snapshot()
+        self.pending = {}
+
+    def _snapshot(self):
+        result = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if is_data_file(entry.name):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    result[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return result
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        current = self._snapshot()
+        events = [("deleted", name) for name in self.known.keys() - current.keys()]
+        for name, signature in current.items():
+            if self.known.get(name) == signature:
+                continue
+            # Файл закрыт, если с прошлого прохода он не изменился
+            if self.pending.get(name) == signature:
+                events.append(("closed", name))
+                self.known[name] = signature
+                del self.pending[name]
+            else:
+                self.pending[name] = signature
+        for name in self.known.keys() - current.keys():
+            del self.known[name]
+        return events
+
+    def close(self):
+        pass
+
+
+def make_watcher(directory, force_polling=False, poll_interval=1.0):
+    if not force_polling:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            print(f"⚠️ inotify недоступен ({e}), используем опрос каталога")
+    return PollingWatcher(directory, poll_interval)
+
+
+def load_index(directory="."):
+    """Текущее содержимое индекса: {имя файла: запись}"""
+    path = os.path.join(directory, INDEX_FILE)
+    index = {}
+    if not os.path.exists(path):
+        return index
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("deleted"):
+                index.pop(record["file"], None)
+            else:
+                index[record["file"]] = record
+    return index
+
+
+def data_files(directory="."):
+    """Имена database_*.parquet файлов каталога для консолидации и агрегатов.
+
+    Список всегда берётся из каталога, а не из индекса: демон принимает
+    файлы пачками и с задержкой, так что только что записанный файл
+    (или файл, записанный пока демон не работал) в индексе ещё может
+    отсутствовать. Файлы идущей компактизации учитываются один раз
+    (см. compaction.list_data_files).
+    """
+    from compaction import list_data_files
+
+    return list_data_files(directory)
+
+
+def _append_index(directory, records):
+    with open(os.path.join(directory, INDEX_FILE), "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def describe_file(path):
+    """Запись индекса по метаданным Parquet (без чтения всех данных)"""
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    record = {
+        "file": os.path.basename(path),
+        "rows": metadata.num_rows,
+        "size": os.path.getsize(path),
+        "ingested_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+    names = parquet_file.schema_arrow.names
+    if "time" in names:
+        position = names.index("time")
+        minimums, maximums = [], []
+        for i in range(metadata.num_row_groups):
+            stats = metadata.row_group(i).column(position).statistics
+            if stats is not None and stats.has_min_max:
+                minimums.append(stats.min)
+                maximums.append(stats.max)
+        if minimums:
+            record["time_min"] = min(minimums)
+            record["time_max"] = max(maximums)
+    if "symbol" in names:
+        symbols = parquet_file.read(columns=["symbol"])["symbol"]
+        record["symbols"] = sorted(s for s in pc.unique(symbols).to_pylist() if s is not None)
+    return record
+
+
+def ingest_batch(directory, names, rollup_dir, upload):
+    """Индексирует, агрегирует и (опционально) загружает пачку новых файлов"""
+    from rollups import update_rollups
+
+    records = []
+    with stage("ingest", files=len(names)) as m:
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                records.append(describe_file(path))
+            except Exception as e:
+                # Файл мог быть удалён или ещё не дописан — run() повторит его позже
+                print(f"❌ Ошибка при чтении файла {name}: {e}")
+                continue
+            m.add_rows(records[-1]["rows"])
+            m.add_file(path)
+        ready = [record["file"] for record in records]
+        if ready:
+            update_rollups(directory, rollup_dir, files=ready)
+            _append_index(directory, records)
+
+    if upload:
+        from create_files_2 import upload_to_cloud
+        for name in ready:
+            upload_to_cloud(os.path.join(directory, name))
+
+    for name in ready:
+        print(f"✅ Принят файл: {name}")
+    return ready
+
+
+def rescan(directory, rollup_dir, upload):
+    """Сверяет индекс с каталогом: принимает новые файлы, отмечает удалённые"""
+    index = load_index(directory)
+    present = {name for name in os.listdir(directory) if is_data_file(name)}
+    gone = sorted(name for name in index if name not in present)
+    if gone:
+        _append_index(directory, [{"file": name, "deleted": True} for name in gone])
+    backlog = sorted(present - index.keys())
+    if backlog:
+        ingest_batch(directory, backlog, rollup_dir, upload)
+    return backlog
+
+
+def run(directory=".", rollup_dir="rollups", upload=False, batch_interval=1.0,
+        force_polling=False, poll_interval=1.0):
+    """Основной цикл демона; завершается по SIGINT/SIGTERM"""
+    if upload:
+        from cloud_settings import get_obs_settings
+        get_obs_settings()
+
+    stop = []
+    signal.signal(signal.SIGTERM, lambda *_: stop.append(True))
+
+    watcher = make_watcher(directory, force_polling, poll_interval)
+    print(f"👀 Наблюдаем за каталогом {os.path.abspath(directory)} ({type(watcher).__name__})")
+
+    # Однократно догоняем файлы, появившиеся пока демон не работал
+    rescan(directory, rollup_dir, upload)
+
+    pending = []
+    deadline = None
+    retries = 0
+    try:
+        while not stop:
+            events = watcher.wait(batch_interval if deadline is None else max(0.0, deadline - time.monotonic()))
+            deleted = []
+            if any(kind == "overflow" for kind, _ in events):
+                print("⚠️ Очередь inotify переполнена, пересканируем каталог")
+                pending, deadline, retries = [], None, 0
+                rescan(directory, rollup_dir, upload)
+                continue
+            for kind, name in events:
+                if not is_data_file(name):
+                    continue
+                if kind == "closed" and name not in pending:
+                    pending.append(name)
+                elif kind == "deleted":
+                    if name in pending:
+                        pending.remove(name)
+                    deleted.append({"file": name, "deleted": True})
+            if deleted:
+                _append_index(directory, deleted)
+            # Копим события batch_interval секунд, чтобы обновлять агрегаты пачками
+            if pending and deadline is None:
+                deadline = time.monotonic() + batch_interval
+            if pending and time.monotonic() >= deadline:
+                try:
+                    ready = ingest_batch(directory, pending, rollup_dir, upload)
+                except Exception as e:
+                    print(f"❌ Ошибка обработки пачки {pending}: {e}")
+                    ready = []
+                # Непринятые файлы остаются в очереди и повторяются с растущей паузой
+                pending = [name for name in pending
+                           if name not in ready and os.path.exists(os.path.join(directory, name))]
+                if pending:
+                    retries += 1
+                    delay = min(MAX_RETRY_DELAY, batch_interval * 2 ** retries)
+                    print(f"⚠️ Не принято файлов: {len(pending)}, повтор через {delay:.0f} с")
+                    deadline = time.monotonic() + delay
+                else:
+                    deadline, retries = None, 0
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pending:
+            try:
+                ingest_batch(directory, pending, rollup_dir, upload)
+            except Exception as e:
+                # Непринятые файлы подхватит rescan при следующем запуске
+                print(f"❌ Ошибка обработки пачки {pending}: {e}")
+        watcher.close()
+        print("👋 Демон остановлен")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Непрерывный приём новых Parquet файлов")
+    parser.add_argument("--dir", default=".", help="Каталог для наблюдения")
+    parser.add_argument("--rollup-dir", default="rollups", help="Каталог агрегатов")
+    parser.add_argument("--upload", action="store_true", help="Загружать принятые файлы в облако")
+    parser.add_argument("--batch-interval", type=float, default=1.0,
+                        help="Сколько секунд копить события перед обработкой")
+    parser.add_argument("--poll", action="store_true", help="Использовать опрос вместо inotify")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Период опроса, с")
+    args = parser.parse_args()
+
+    run(args.dir, args.rollup_dir, args.upload, args.batch_interval, args.poll, args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
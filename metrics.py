@@ -0,0 +1,301 @@
+"""Лёгкая инструментация этапов: время, строки/с, байты, пиковый RSS.
+
+Использование:
+
+    from metrics import stage
+
+    with stage("parquet_write", rows=len(df)) as m:
+        df.to_parquet(path)
+        m.add_file(path)
+
+Каждый завершённый этап выдаётся одной JSON-строкой. Куда писать,
+управляется переменными окружения (или функцией configure()):
+
+    METRICS_JSONL    путь к файлу JSON lines; "-" — stderr (по умолчанию),
+                     пустая строка — отключить
+    METRICS_PROM     путь к текстовому файлу в формате Prometheus
+                     (для textfile collector node_exporter); по умолчанию не пишется.
+                     Файл пишет только главный процесс: этапы из дочерних
+                     процессов попадают в него через run_captured()/absorb()
+    METRICS_PROFILE  "cprofile", "tracemalloc" или оба через запятую
+    METRICS_PROFILE_STAGES  список этапов через запятую (по умолчанию все)
+    METRICS_PROFILE_DIR     каталог для .prof файлов (по умолчанию "profiles")
+
+Профилируются только внешние этапы (вложенность считается отдельно для
+каждого потока и asyncio-задачи) и не больше одного одновременно:
+tracemalloc общий на процесс.
+"""
+import contextvars
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+_config = {
+    "jsonl": os.getenv("METRICS_JSONL", "-"),
+    "prom": os.getenv("METRICS_PROM", ""),
+    "profile": {p.strip() for p in os.getenv("METRICS_PROFILE", "").split(",") if p.strip()},
+    "profile_stages": {s.strip() for s in os.getenv("METRICS_PROFILE_STAGES", "").split(",") if s.strip()},
+    "profile_dir": os.getenv("METRICS_PROFILE_DIR", "profiles"),
+}
+
+# Последние записи процесса (для get_records); ограничены, чтобы демоны не росли
+_records = deque(maxlen=1000)
+# Для Prometheus — только последняя запись на пару (этап, статус)
+_latest = {}
+# Списки, собирающие записи внутри capture()
+_captures = []
+# Глубина вложенности этапов: профилировщики включаются только на внешнем уровне.
+# Своя у каждого потока и asyncio-задачи — параллельные этапы друг другу не мешают
+_depth = contextvars.ContextVar("metrics_stage_depth", default=0)
+# tracemalloc общий на процесс: одновременно профилируется только один этап
+_profile_lock = threading.Lock()
+
+
+def configure(jsonl=None, prom=None, profile=None, profile_stages=None, profile_dir=None):
+    """Переопределяет настройки, заданные через переменные окружения"""
+    if jsonl is not None:
+        _config["jsonl"] = jsonl
+    if prom is not None:
+        _config["prom"] = prom
+    if profile is not None:
+        _config["profile"] = set(profile)
+    if profile_stages is not None:
+        _config["profile_stages"] = set(profile_stages)
+    if profile_dir is not None:
+        _config["profile_dir"] = profile_dir
+
+
+def _peak_rss_bytes():
+    """Пиковый RSS процесса в байтах (или None, если определить нельзя)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux отдаёт килобайты, macOS — байты
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    except Exception:
+        return None
+
+
+class StageMetrics:
+    """Метрики одного этапа; наполняется внутри блока with stage(...)"""
+
+    def __init__(self, name, rows=0, labels=None):
+        self.name = name
+        self.rows = rows
+        self.bytes = 0
+        self.labels = labels or {}
+        self.status = "ok"
+        self.wall_time = 0.0
+        self.peak_rss = None
+        self.tracemalloc_peak = None
+        self.profile_file = None
+
+    def add_rows(self, n):
+        self.rows += n
+
+    def add_bytes(self, n):
+        self.bytes += n
+
+    def add_file(self, path):
+        """Учитывает размер записанного/отправленного файла"""
+        try:
+            self.bytes += os.path.getsize(path)
+        except OSError:
+            pass
+
+    def as_dict(self):
+        rows_per_s = self.rows / self.wall_time if self.rows and self.wall_time > 0 else None
+        record = {
+            "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "stage": self.name,
+            "status": self.status,
+            "wall_time_s": round(self.wall_time, 6),
+            "rows": self.rows,
+            "rows_per_s": round(rows_per_s, 1) if rows_per_s is not None else None,
+            "bytes": self.bytes,
+            "peak_rss_bytes": self.peak_rss,
+        }
+        if self.tracemalloc_peak is not None:
+            record["tracemalloc_peak_bytes"] = self.tracemalloc_peak
+        if self.profile_file:
+            record["profile_file"] = self.profile_file
+        if self.labels:
+            record["labels"] = self.labels
+        return record
+
+
+def _should_profile(name):
+    # Вложенные этапы не профилируем: их время уже входит во внешний
+    if not _config["profile"] or _depth.get() > 1:
+        return False
+    return not _config["profile_stages"] or name in _config["profile_stages"]
+
+
+@contextmanager
+def stage(name, rows=0, **labels):
+    """Контекстный менеджер, замеряющий этап и выдающий его метрики"""
+    m = StageMetrics(name, rows, labels)
+    depth_token = _depth.set(_depth.get() + 1)
+    # Параллельный внешний этап (другой поток или задача) уже профилируется —
+    # этот идёт без профилировщиков, чтобы не сбрасывать чужой пик tracemalloc
+    profiling = _should_profile(name) and _profile_lock.acquire(blocking=False)
+
+    profiler = None
+    started_tracing = False
+    if profiling and "cprofile" in _config["profile"]:
+        import cProfile
+        profiler = cProfile.Profile()
+    if profiling and "tracemalloc" in _config["profile"]:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield m
+    except BaseException:
+        m.status = "error"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        m.wall_time = time.perf_counter() - start
+        _depth.reset(depth_token)
+
+        if profiling and "tracemalloc" in _config["profile"]:
+            import tracemalloc
+            m.tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+        if profiling:
+            _profile_lock.release()
+        if profiler is not None:
+            os.makedirs(_config["profile_dir"], exist_ok=True)
+            safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+            m.profile_file = os.path.join(
+                _config["profile_dir"], f"{safe_name}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.prof"
+            )
+            profiler.dump_stats(m.profile_file)
+
+        m.peak_rss = _peak_rss_bytes()
+        try:
+            _emit(m)
+        except Exception as e:
+            # Сбой записи метрик не должен ломать измеряемую работу
+            print(f"⚠️ Не удалось записать метрики этапа {name}: {e}", file=sys.stderr)
+
+
+def _is_worker_process():
+    return multiprocessing.parent_process() is not None
+
+
+def _remember(record):
+    _records.append(record)
+    _latest[(record["stage"], record["status"])] = record
+
+
+def _emit(m):
+    record = m.as_dict()
+    _remember(record)
+    for captured in _captures:
+        captured.append(record)
+
+    target = _config["jsonl"]
+    if target:
+        line = json.dumps(record, ensure_ascii=False)
+        if target == "-":
+            print(line, file=sys.stderr, flush=True)
+        else:
+            with open(target, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    if _config["prom"] and not _is_worker_process():
+        write_prometheus(_config["prom"])
+
+
+@contextmanager
+def capture():
+    """Собирает в список записи этапов, завершившихся внутри блока"""
+    captured = []
+    _captures.append(captured)
+    try:
+        yield captured
+    finally:
+        _captures.remove(captured)
+
+
+def run_captured(func, *args, **kwargs):
+    """Выполняет func и возвращает (результат, записи её этапов).
+
+    Для ProcessPoolExecutor: дочерний процесс не пишет Prometheus-файл,
+    главный передаёт полученные записи в absorb().
+    """
+    with capture() as captured:
+        result = func(*args, **kwargs)
+    return result, captured
+
+
+def absorb(records):
+    """Учитывает записи этапов из дочерних процессов"""
+    for record in records:
+        _remember(record)
+    if records and _config["prom"] and not _is_worker_process():
+        try:
+            write_prometheus(_config["prom"])
+        except Exception as e:
+            print(f"⚠️ Не удалось записать метрики Prometheus: {e}", file=sys.stderr)
+
+
+def _prom_labels(record):
+    # Метки файлов/потоков в Prometheus не выносим: каждая давала бы отдельный ряд
+    labels = {"stage": record["stage"], "status": record["status"]}
+    parts = []
+    for k, v in labels.items():
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def write_prometheus(path):
+    """Атомарно перезаписывает текстовый файл Prometheus (последнее значение каждого этапа)"""
+    metrics = [
+        ("stage_wall_time_seconds", "wall_time_s", "Длительность этапа"),
+        ("stage_rows", "rows", "Обработано строк"),
+        ("stage_rows_per_second", "rows_per_s", "Скорость обработки строк"),
+        ("stage_bytes", "bytes", "Записано или отправлено байт"),
+        ("stage_peak_rss_bytes", "peak_rss_bytes", "Пиковый RSS процесса после этапа"),
+    ]
+    lines = []
+    for metric, key, help_text in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for record in _latest.values():
+            value = record.get(key)
+            if value is not None:
+                lines.append(f"{metric}{_prom_labels(record)} {value}")
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def get_records():
+    """Возвращает метрики последних (до 1000) завершённых этапов текущего процесса"""
+    return list(_records)
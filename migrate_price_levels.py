@@ -0,0 +1,137 @@
+"""Массовая миграция файлов с JSON-колонкой priceLevels на типизированные колонки.
+
+Старые database_*.parquet и consolidated_database_*.parquet хранят цены
+JSON-строкой со строковыми числами. Миграция заменяет priceLevels на
+bid_price, bid_size, ask_price, ask_size (int64) — разбор всей колонки
+идёт через price_levels.parse_price_levels, без json.loads по строкам.
+
+Файлы обрабатываются параллельно в отдельных процессах. Уже
+сконвертированные файлы (есть типизированные колонки и нет priceLevels)
+пропускаются, поэтому миграцию можно запускать повторно. Запись
+атомарна: временный файл, затем os.replace.
+
+Примеры:
+
+    python migrate_price_levels.py --dir .
+    python migrate_price_levels.py --keep-json --compression zstd
+    python migrate_price_levels.py --dry-run
+"""
+import argparse
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from metrics import absorb, run_captured, stage
+from price_levels import PRICE_COLUMNS
+
+FILE_RE = re.compile(r"^(?:consolidated_)?database_.+\.parquet$")
+MARKER_KEY = b"price_levels"
+TMP_SUFFIX = ".migrating"
+
+
+def needs_migration(schema):
+    """True, если в файле ещё есть priceLevels без типизированных колонок"""
+    names = set(schema.names)
+    return "priceLevels" in names and not set(PRICE_COLUMNS) <= names
+
+
+def find_files(directory="."):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if FILE_RE.match(name))
+
+
+def migrate_file(path, keep_json=False, parquet_options=None):
+    """Переписывает один файл; возвращает (строк, байт до, байт после) или None, если пропущен"""
+    import pyarrow.parquet as pq
+    from price_levels import parse_price_levels
+    from storage import write_parquet
+
+    if not needs_migration(pq.read_schema(path)):
+        return None
+
+    size_before = os.path.getsize(path)
+    with stage("migrate", file=os.path.basename(path)) as m:
+        table = pq.read_table(path)
+        prices = parse_price_levels(table["priceLevels"])
+        position = table.schema.get_field_index("priceLevels")
+        if not keep_json:
+            table = table.remove_column(position)
+            position -= 1
+        for offset, name in enumerate(PRICE_COLUMNS, start=1):
+            table = table.add_column(position + offset, name, prices[name])
+
+        # Метаданные pandas описывают старый набор колонок — убираем их
+        metadata = {k: v for k, v in (table.schema.metadata or {}).items() if k != b"pandas"}
+        metadata[MARKER_KEY] = b"int64"
+        table = table.replace_schema_metadata(metadata)
+
+        tmp_path = f"{path}{TMP_SUFFIX}"
+        try:
+            size_after = write_parquet(table, tmp_path, **(parquet_options or {}))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        m.add_rows(table.num_rows)
+        m.add_bytes(size_after)
+    return table.num_rows, size_before, size_after
+
+
+def migrate(paths, jobs=None, keep_json=False, parquet_options=None, dry_run=False):
+    """Мигрирует файлы параллельно; возвращает число переписанных файлов"""
+    import pyarrow.parquet as pq
+
+    pending = []
+    for path in paths:
+        try:
+            if needs_migration(pq.read_schema(path)):
+                pending.append(path)
+        except Exception as e:
+            print(f"❌ Ошибка при чтении файла {path}: {e}")
+    skipped = len(paths) - len(pending)
+    if skipped:
+        print(f"ℹ️ Пропущено {skipped} файлов (уже сконвертированы или не читаются)")
+    if dry_run or not pending:
+        for path in pending:
+            print(f"   будет сконвертирован: {path}")
+        return 0
+
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(pending)))
+    done = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_captured, migrate_file, path, keep_json, parquet_options): path for path in pending}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result, records = future.result()
+                absorb(records)
+            except Exception as e:
+                print(f"❌ Ошибка миграции {path}: {e}")
+                continue
+            if result is None:
+                continue
+            rows, before, after = result
+            done += 1
+            print(f"✅ {path}: {rows} строк, {before} -> {after} байт")
+    print(f"✅ Сконвертировано файлов: {done} из {len(pending)}")
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграция priceLevels (JSON) на типизированные колонки")
+    parser.add_argument("files", nargs="*", help="Файлы (по умолчанию все database_*.parquet в --dir)")
+    parser.add_argument("--dir", default=".", help="Каталог с файлами")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Процессов")
+    parser.add_argument("--keep-json", action="store_true", help="Оставить исходную колонку priceLevels")
+    parser.add_argument("--compression", help="Кодек Parquet (snappy, zstd, ...)")
+    parser.add_argument("--compression-level", type=int, help="Уровень сжатия Parquet")
+    parser.add_argument("--dry-run", action="store_true", help="Только показать, что будет сконвертировано")
+    args = parser.parse_args()
+
+    paths = args.files or find_files(args.dir)
+    parquet_options = {"compression": args.compression, "compression_level": args.compression_level}
+    migrate(paths, args.jobs, args.keep_json, parquet_options, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
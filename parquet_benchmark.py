@@ -0,0 +1,123 @@
+"""Сравнение вариантов сжатия Parquet на выборке реальных файлов.
+
+Для каждого варианта (кодек, уровень, словарь, BYTE_STREAM_SPLIT)
+записывает выборку во временный файл и печатает размер, время записи
+и время чтения. Пример:
+
+    python parquet_benchmark.py --sample 20 --repeat 3
+    python parquet_benchmark.py consolidated_database_2025-10-13.parquet --codecs zstd --levels 1 3 9 19
+"""
+import argparse
+import glob
+import os
+import random
+import tempfile
+import time
+
+from storage import write_parquet
+
+DEFAULT_PATTERNS = ["database_*.parquet", "consolidated_database_*.parquet"]
+DEFAULT_CODECS = ["none", "snappy", "lz4", "gzip", "brotli", "zstd"]
+# Уровни проверяются только для кодеков, которые их поддерживают
+LEVELS = {"gzip": [1, 6, 9], "brotli": [1, 5, 11], "zstd": [1, 3, 6, 9, 15, 19]}
+
+
+def load_sample(paths, sample_size, seed=0):
+    """Читает случайную выборку файлов и объединяет её в одну таблицу"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if sample_size and len(paths) > sample_size:
+        paths = random.Random(seed).sample(paths, sample_size)
+    tables = []
+    for path in paths:
+        try:
+            tables.append(pq.read_table(path))
+        except Exception as e:
+            print(f"❌ Ошибка при чтении файла {path}: {e}")
+    if not tables:
+        return None, []
+    return pa.concat_tables(tables, promote_options="default"), paths
+
+
+def build_variants(schema, codecs, levels=None):
+    """Список вариантов (название, параметры write_parquet)"""
+    import pyarrow.types as pat
+
+    int_columns = [f.name for f in schema if pat.is_integer(f.type)]
+    delta = {col: "DELTA_BINARY_PACKED" for col in int_columns}
+    variants = []
+    for codec in codecs:
+        codec_levels = levels if levels and codec in LEVELS else LEVELS.get(codec, [None])
+        for level in codec_levels:
+            name = codec if level is None else f"{codec}-{level}"
+            base = {"compression": codec, "compression_level": level}
+            variants.append((name, dict(base, use_dictionary=True, byte_stream_split=False)))
+            variants.append((f"{name} no-dict", dict(base, use_dictionary=False, byte_stream_split=False)))
+            variants.append((f"{name} bss", dict(base, use_dictionary=True, byte_stream_split=True)))
+            if delta:
+                variants.append((f"{name} delta", dict(base, use_dictionary=True, byte_stream_split=False,
+                                                       column_encoding=delta)))
+    return variants
+
+
+def measure(table, options, repeat, tmp_dir):
+    """Возвращает (размер, лучшее время записи, лучшее время чтения)"""
+    import pyarrow.parquet as pq
+
+    path = os.path.join(tmp_dir, "bench.parquet")
+    write_times, read_times = [], []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = write_parquet(table, path, **options)
+        write_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        pq.read_table(path)
+        read_times.append(time.perf_counter() - start)
+    os.remove(path)
+    return size, min(write_times), min(read_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение кодеков и кодировок Parquet")
+    parser.add_argument("files", nargs="*", help="Файлы Parquet (по умолчанию database_*.parquet и consolidated_*)")
+    parser.add_argument("--sample", type=int, default=20, help="Сколько файлов взять в выборку (0 — все)")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов на вариант (берётся лучшее время)")
+    parser.add_argument("--codecs", nargs="+", default=DEFAULT_CODECS, help="Кодеки для сравнения")
+    parser.add_argument("--levels", nargs="+", type=int, help="Уровни сжатия вместо стандартного набора")
+    parser.add_argument("--seed", type=int, default=0, help="Seed для выбора файлов")
+    args = parser.parse_args()
+
+    paths = args.files or sorted({p for pattern in DEFAULT_PATTERNS for p in glob.glob(pattern)})
+    if not paths:
+        print("❌ Parquet файлы не найдены")
+        return
+
+    table, used = load_sample(paths, args.sample, args.seed)
+    if table is None:
+        print("❌ Не удалось прочитать ни одного файла")
+        return
+    raw_size = sum(os.path.getsize(p) for p in used)
+    print(f"📊 Выборка: {len(used)} файлов, {table.num_rows} строк, {raw_size} байт на диске")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, options in build_variants(table.schema, args.codecs, args.levels):
+            try:
+                size, write_s, read_s = measure(table, options, args.repeat, tmp_dir)
+            except Exception as e:
+                print(f"⚠️ {name}: {e}")
+                continue
+            results.append((name, size, write_s, read_s))
+
+    baseline = next((r[1] for r in results if r[0] == "snappy"), None)
+    print(f"\n{'вариант':<22}{'размер, байт':>14}{'к snappy':>10}{'запись, мс':>12}{'чтение, мс':>12}")
+    for name, size, write_s, read_s in sorted(results, key=lambda r: r[1]):
+        ratio = f"{size / baseline:.2f}" if baseline else "-"
+        print(f"{name:<22}{size:>14}{ratio:>10}{write_s * 1000:>12.1f}{read_s * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Векторный разбор колонки priceLevels.
+
+priceLevels хранится JSON-строкой со строковыми числами:
+
+    {"bid": {"price": "10123456", "size": "2000000"}, "ask": {...}}
+
+Вместо json.loads по строкам вся колонка склеивается в один NDJSON-буфер
+и разбирается JSON-ридером Arrow (C++, многопоточно), после чего поля
+приводятся к int64 вычислительными ядрами Arrow.
+
+JSON-ридер требует одного типа поля на всю колонку, поэтому числа без
+кавычек ("price": 10123456 — так пишут некоторые источники) заранее
+берутся в кавычки регулярным выражением по всей колонке. Пустые строки
+разбираются как null, так же как отсутствующие значения.
+"""
+PRICE_COLUMNS = ("bid_price", "bid_size", "ask_price", "ask_size")
+# "price": 123 -> "price": "123"
+UNQUOTED_NUMBER = r'("(?:price|size)"\s*:\s*)(-?[0-9][0-9.eE+-]*)'
+
+
+def _level_schema():
+    import pyarrow as pa
+
+    level = pa.struct([("price", pa.string()), ("size", pa.string())])
+    return pa.schema([("bid", level), ("ask", level)])
+
+
+def parse_price_levels(column):
+    """Разбирает массив/колонку JSON-строк priceLevels.
+
+    Возвращает pyarrow.Table с колонками bid_price, bid_size, ask_price,
+    ask_size (int64); пустые и null значения дают null.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.json as pa_json
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    column = column.cast(pa.large_string())
+    if len(column) == 0:
+        return pa.table({name: pa.array([], pa.int64()) for name in PRICE_COLUMNS})
+
+    column = pc.fill_null(column, "{}")
+    column = pc.if_else(pc.equal(pc.utf8_trim_whitespace(column), ""), "{}", column)
+    # Переводы строк внутри значения разорвали бы NDJSON (в JSON это просто пробелы)
+    column = pc.replace_substring_regex(column, pattern=r"[\r\n]", replacement=" ")
+    column = pc.replace_substring_regex(column, pattern=UNQUOTED_NUMBER, replacement=r'\1"\2"')
+
+    # Одна строка JSON на значение: "<json>\n<json>\n..."
+    newline, empty = pa.scalar("\n", pa.large_string()), pa.scalar("", pa.large_string())
+    lines = pc.binary_join_element_wise(column, newline, empty)
+    offsets = np.frombuffer(lines.buffers()[1], dtype=np.int64)
+    start, end = offsets[lines.offset], offsets[lines.offset + len(lines)]
+    buffer = lines.buffers()[2].slice(start, end - start)
+
+    parsed = pa_json.read_json(
+        pa.BufferReader(buffer),
+        parse_options=pa_json.ParseOptions(explicit_schema=_level_schema(),
+                                           unexpected_field_behavior="ignore"),
+    )
+    if parsed.num_rows != len(column):
+        raise ValueError(f"priceLevels: разобрано {parsed.num_rows} строк из {len(column)}")
+
+    result = {}
+    for side in ("bid", "ask"):
+        side_column = parsed[side]
+        for field in ("price", "size"):
+            values = pc.struct_field(side_column, field)
+            try:
+                result[f"{side}_{field}"] = pc.cast(values, pa.int64())
+            except pa.ArrowInvalid:
+                # Дробная запись целого ("100.0", "1e6")
+                result[f"{side}_{field}"] = pc.cast(pc.cast(values, pa.float64()), pa.int64())
+    return pa.table(result)
+
+
+def price_columns(table):
+    """Типизированные ценовые колонки таблицы.
+
+    Если файл уже сконвертирован (есть bid_price и др.), берёт их как есть,
+    иначе разбирает priceLevels. В смешанных таблицах (консолидация или
+    компактизация старых и сконвертированных файлов) пропуски в
+    типизированных колонках заполняются из priceLevels.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    typed = all(name in table.column_names for name in PRICE_COLUMNS)
+    if typed and "priceLevels" in table.column_names and table["priceLevels"].null_count < table.num_rows:
+        parsed = parse_price_levels(table["priceLevels"])
+        return pa.table({name: pc.coalesce(table[name], parsed[name]) for name in PRICE_COLUMNS})
+    if typed:
+        return pa.table({name: table[name] for name in PRICE_COLUMNS})
+    return parse_price_levels(table["priceLevels"])
@@ -0,0 +1,448 @@
+"""Потоковая выдача котировок для нагрузочного тестирования потребителей.
+
+Котировки (NDJSON, по одной на строку) либо генерируются векторно
+(numpy, пачками), либо воспроизводятся из database_*.parquet в порядке
+времени. Каналы: TCP-сервер, Unix-сокет или stdout. Каждый подключившийся
+потребитель получает свой поток.
+
+Скорость задаётся --rate (котировок/с, 0 — без ограничения): пачка
+из --batch котировок отправляется в момент start + отправлено / rate.
+Обратное давление — через drain(): медленный потребитель тормозит свой
+поток, а не раздувает буфер сервера. В конце (и каждые --report-interval
+секунд) печатается достигнутая скорость и отставание пачек от
+расписания (p50/p99).
+
+В каждой строке есть seq и sendTs (unix-время отправки), так что
+потребитель на той же машине считает задержку доставки; встроенный
+потребитель (--consume) печатает скорость и p50/p99 задержки.
+
+Строковые поля подставляются в шаблон уже закодированными в JSON
+(кавычки и экранирование — json.dumps), поэтому кавычки, обратные
+слэши и переводы строк в данных из файлов не ломают NDJSON. При
+воспроизведении это делается один раз при загрузке таблицы.
+
+Примеры:
+
+    python quote_stream.py --transport tcp --port 9100 --rate 100000 --duration 30
+    python quote_stream.py --consume --transport tcp --port 9100
+
+    python quote_stream.py --source replay --dir . --transport unix --path /tmp/quotes.sock
+    python quote_stream.py --transport stdout --rate 1000 --count 5000 > quotes.ndjson
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from metrics import stage
+
+DEFAULT_SYMBOLS = ['CNY/RUB', 'USD/RUB', 'EUR/RUB', 'INR/RUB']
+TENORS = ['TOM', 'TOD', 'SPOT', 'ON']
+TIERS = ['TRADER1', 'TRADER2', 'TRADER3', 'TRADER4', 'TRADER5']
+TENORS_JSON = [json.dumps(t) for t in TENORS]
+TIERS_JSON = [json.dumps(t) for t in TIERS]
+# Диапазоны bid, как в create_files_2.generate_random_data
+PRICE_RANGES = {
+    'CNY/RUB': (10000000, 14000000),
+    'USD/RUB': (78000000, 110000000),
+    'EUR/RUB': (88000000, 120000000),
+    'INR/RUB': (800000, 1200000),
+}
+DEFAULT_PRICE_RANGE = (800000, 120000000)
+
+LINE_PREFIX = '{"seq":%d,"sendTs":%.6f,'
+# Строковые поля и priceLevels подставляются уже в виде JSON (см. _json)
+QUOTE_TEMPLATE = ('"time":%s,"ulid":%s,"symbol":%s,"state":%d,"tenor":%s,'
+                  '"valueDateNear":%s,"globalTradable":%d,"globalIndicative":%d,'
+                  '"rateId":%d,"tier":%s,"priceLevels":%s}\n')
+LEVELS_TEMPLATE = '{"bid":{"price":"%d","size":"%d"},"ask":{"price":"%d","size":"%d"}}'
+STRING_FIELDS = ("time", "ulid", "symbol", "tenor", "valueDateNear", "tier")
+
+
+def _format_time(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _json(value):
+    """JSON-литерал значения: строка в кавычках с экранированием, None -> null"""
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _typed_levels(bid_price, bid_size, ask_price, ask_size):
+    """priceLevels из типизированных колонок; пропущенные цены дают null"""
+    if None not in (bid_price, bid_size, ask_price, ask_size):
+        return LEVELS_TEMPLATE % (bid_price, bid_size, ask_price, ask_size)
+
+    def level(price, size):
+        return {"price": None if price is None else str(price),
+                "size": None if size is None else str(size)}
+    return json.dumps({"bid": level(bid_price, bid_size), "ask": level(ask_price, ask_size)},
+                      separators=(",", ":"))
+
+
+def _raw_levels(value):
+    """Исходная строка priceLevels, если это JSON, иначе она же как JSON-строка"""
+    if value is None or not value.strip():
+        return "null"
+    try:
+        json.loads(value)
+    except ValueError:
+        return _json(value)
+    # Переводы строк внутри JSON разорвали бы NDJSON
+    return value.replace("\r", " ").replace("\n", " ")
+
+
+class GeneratedQuotes:
+    """Векторный генератор котировок: вся пачка — несколько вызовов numpy"""
+
+    def __init__(self, symbols=None, seed=None):
+        import numpy as np
+
+        self.np = np
+        self.rng = np.random.default_rng(seed)
+        self.symbols = list(symbols or DEFAULT_SYMBOLS)
+        self.symbols_json = [_json(s) for s in self.symbols]
+        ranges = [PRICE_RANGES.get(s, DEFAULT_PRICE_RANGE) for s in self.symbols]
+        self.low = np.array([r[0] for r in ranges], dtype=np.int64)
+        self.high = np.array([r[1] for r in ranges], dtype=np.int64)
+
+    def batch(self, seq, count, send_ts):
+        np, rng = self.np, self.rng
+        moment = datetime.fromtimestamp(send_ts, timezone.utc)
+        now = _json(_format_time(moment))
+        value_dates = [_json(_format_time(moment + timedelta(days=d))) for d in range(1, 6)]
+
+        symbol_idx = rng.integers(0, len(self.symbols), count)
+        bid = rng.integers(self.low[symbol_idx], self.high[symbol_idx])
+        ask = bid + rng.integers(100000, 500000, count)
+        size = rng.integers(100000, 5000000, count)
+        tradable = rng.integers(0, 2, count)
+        ulids = os.urandom(12 * count).hex().upper()
+
+        columns = zip(
+            (now,) * count,
+            ('"%s"' % ulids[i * 24:(i + 1) * 24] for i in range(count)),
+            [self.symbols_json[i] for i in symbol_idx.tolist()],
+            rng.integers(0, 2, count).tolist(),
+            [TENORS_JSON[i] for i in rng.integers(0, len(TENORS), count).tolist()],
+            [value_dates[i] for i in rng.integers(0, 5, count).tolist()],
+            tradable.tolist(),
+            (1 - tradable).tolist(),
+            rng.integers(10000000000, 99999999999, count).tolist(),
+            [TIERS_JSON[i] for i in rng.integers(0, len(TIERS), count).tolist()],
+            bid.tolist(), size.tolist(), ask.tolist(),
+        )
+        lines = [
+            LINE_PREFIX % (seq + i, send_ts)
+            + QUOTE_TEMPLATE % (t, u, s, st, te, v, g, gi, r, ti,
+                                LEVELS_TEMPLATE % (b, sz, a, sz))
+            for i, (t, u, s, st, te, v, g, gi, r, ti, b, sz, a) in enumerate(columns)
+        ]
+        return "".join(lines).encode()
+
+
+class ReplayedQuotes:
+    """Воспроизведение database_*.parquet в порядке времени.
+
+    Таблица читается и сортируется один раз, строковые поля и
+    priceLevels сразу кодируются в JSON; каждый поток идёт по ней своим
+    курсором (см. cursor()).
+    """
+
+    def __init__(self, paths, loop=False):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from price_levels import PRICE_COLUMNS, price_columns
+
+        if not paths:
+            raise FileNotFoundError("Нет database_*.parquet файлов для воспроизведения")
+        tables = []
+        for path in paths:
+            table = pq.read_table(path)
+            try:
+                prices = price_columns(table)
+                levels = [_typed_levels(*row) for row in zip(
+                    prices["bid_price"].to_pylist(), prices["bid_size"].to_pylist(),
+                    prices["ask_price"].to_pylist(), prices["ask_size"].to_pylist())]
+            except (pa.ArrowInvalid, ValueError) as e:
+                # Битый JSON в priceLevels — отдаём строки как есть, построчно
+                print(f"⚠️ {path}: priceLevels не разобран ({e}), строки передаются без разбора",
+                      file=sys.stderr)
+                levels = [_raw_levels(v) for v in table["priceLevels"].to_pylist()]
+            if "priceLevels" in table.column_names:
+                table = table.drop_columns(["priceLevels"])
+            table = table.append_column("priceLevels", pa.array(levels, pa.string()))
+            keep = [c for c in table.column_names if c not in PRICE_COLUMNS and c != "source_file"]
+            tables.append(table.select(keep))
+        table = pa.concat_tables(tables, promote_options="default").sort_by("time")
+        for name in STRING_FIELDS:
+            if name in table.column_names:
+                position = table.column_names.index(name)
+                encoded = pa.array([_json(v) for v in table[name].to_pylist()], pa.string())
+                table = table.set_column(position, name, encoded)
+        self.table = table
+        self.loop = loop
+        print(f"📂 Воспроизведение: {len(paths)} файлов, {self.table.num_rows} котировок", file=sys.stderr)
+
+    def cursor(self):
+        return _ReplayCursor(self.table, self.loop)
+
+
+class _ReplayCursor:
+    COLUMNS = ("time", "ulid", "symbol", "state", "tenor", "valueDateNear",
+               "globalTradable", "globalIndicative", "rateId", "tier", "priceLevels")
+
+    def __init__(self, table, loop):
+        self.table = table
+        self.loop = loop
+        self.position = 0
+
+    def batch(self, seq, count, send_ts):
+        if self.position >= self.table.num_rows:
+            if not self.loop or self.table.num_rows == 0:
+                return None
+            self.position = 0
+        chunk = self.table.slice(self.position, count)
+        self.position += chunk.num_rows
+        columns = [chunk[name].to_pylist() for name in self.COLUMNS]
+        lines = [
+            LINE_PREFIX % (seq + i, send_ts)
+            + QUOTE_TEMPLATE % (t, u, s, st or 0, te, v, g or 0, gi or 0, r or 0, ti, p)
+            for i, (t, u, s, st, te, v, g, gi, r, ti, p) in enumerate(zip(*columns))
+        ]
+        return "".join(lines).encode()
+
+
+def percentiles(values, points=(50, 99)):
+    import numpy as np
+
+    if not values:
+        return {p: 0.0 for p in points}
+    result = np.percentile(np.asarray(values), points)
+    return dict(zip(points, result.tolist()))
+
+
+class StreamStats:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.monotonic()
+        self.quotes = 0
+        self.bytes = 0
+        self.lags = []
+        self._last_quotes = 0
+        self._last_time = self.started
+
+    def record(self, count, size, lag):
+        self.quotes += count
+        self.bytes += size
+        self.lags.append(lag)
+
+    def interval_report(self):
+        now = time.monotonic()
+        rate = (self.quotes - self._last_quotes) / max(now - self._last_time, 1e-9)
+        self._last_quotes, self._last_time = self.quotes, now
+        return f"⏱️ {self.name}: {rate:,.0f} котировок/с, всего {self.quotes:,}"
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        lag = percentiles(self.lags)
+        return (f"✅ {self.name}: {self.quotes:,} котировок за {elapsed:.2f} с — "
+                f"{self.quotes / elapsed:,.0f} котировок/с, {self.bytes / elapsed / 1e6:.1f} МБ/с; "
+                f"отставание пачки от расписания p50 {lag[50] * 1000:.2f} мс, "
+                f"p99 {lag[99] * 1000:.2f} мс")
+
+
+async def pump(writer, source, rate, batch_size, count=None, duration=None, name="stream",
+               report_interval=0):
+    """Пишет котировки в writer по расписанию rate с обратным давлением drain()"""
+    stats = StreamStats(name)
+    start = time.monotonic()
+    sent = 0
+    next_report = start + report_interval if report_interval else None
+    with stage("stream", stream=name) as m:
+        try:
+            while count is None or sent < count:
+                now = time.monotonic()
+                if duration is not None and now - start >= duration:
+                    break
+                due = start + sent / rate if rate else now
+                if due > now:
+                    await asyncio.sleep(due - now)
+                n = batch_size if count is None else min(batch_size, count - sent)
+                payload = source.batch(sent, n, time.time())
+                if payload is None:
+                    break
+                writer.write(payload)
+                await writer.drain()
+                n = payload.count(b"\n")
+                stats.record(n, len(payload), time.monotonic() - due)
+                sent += n
+                if next_report is not None and time.monotonic() >= next_report:
+                    print(stats.interval_report(), file=sys.stderr)
+                    next_report += report_interval
+        except (ConnectionResetError, BrokenPipeError):
+            print(f"⚠️ {name}: потребитель отключился", file=sys.stderr)
+        finally:
+            m.add_rows(stats.quotes)
+            m.add_bytes(stats.bytes)
+    print(stats.summary(), file=sys.stderr)
+    return stats
+
+
+class _SyncWriter:
+    """Запись в обычный файл (stdout перенаправлен в файл): asyncio pipe там не работает"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        self.stream.write(data)
+
+    async def drain(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+
+
+async def _stdout_writer():
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout.buffer)
+    except ValueError:
+        return _SyncWriter(sys.stdout.buffer)
+    return asyncio.StreamWriter(transport, protocol, None, loop)
+
+
+def make_source_factory(args):
+    """Фабрика источников: у каждого потока свой генератор или курсор"""
+    if args.source == "replay":
+        paths = args.files or sorted(glob.glob(os.path.join(args.dir, "database_*.parquet")))
+        replay = ReplayedQuotes(paths, loop=args.loop)
+        return replay.cursor
+    counter = iter(range(1 << 30))
+    return lambda: GeneratedQuotes(args.symbols, None if args.seed is None else args.seed + next(counter))
+
+
+async def serve(args):
+    factory = make_source_factory(args)
+    stream_options = dict(rate=args.rate, batch_size=args.batch, count=args.count,
+                          duration=args.duration, report_interval=args.report_interval)
+
+    if args.transport == "stdout":
+        writer = await _stdout_writer()
+        try:
+            await pump(writer, factory(), name="stdout", **stream_options)
+        finally:
+            writer.close()
+        return
+
+    clients = []
+
+    async def handle(reader, writer):
+        peer = writer.get_extra_info("peername") or args.path
+        writer.transport.set_write_buffer_limits(high=args.buffer)
+        print(f"🔌 Подключился потребитель {peer}", file=sys.stderr)
+        task = asyncio.current_task()
+        clients.append(task)
+        try:
+            await pump(writer, factory(), name=str(peer), **stream_options)
+        finally:
+            writer.close()
+            clients.remove(task)
+
+    if args.transport == "tcp":
+        server = await asyncio.start_server(handle, args.host, args.port)
+        where = f"tcp://{args.host}:{args.port}"
+    else:
+        if os.path.exists(args.path):
+            os.remove(args.path)
+        server = await asyncio.start_unix_server(handle, args.path)
+        where = f"unix:{args.path}"
+    print(f"🚀 Выдача котировок на {where}: rate {args.rate or '∞'}/с, пачка {args.batch}", file=sys.stderr)
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            for task in list(clients):
+                task.cancel()
+            if args.transport == "unix" and os.path.exists(args.path):
+                os.remove(args.path)
+
+
+async def consume(args):
+    """Простой потребитель: скорость приёма и задержка доставки по sendTs"""
+    if args.transport == "tcp":
+        reader, writer = await asyncio.open_connection(args.host, args.port, limit=1 << 20)
+    elif args.transport == "unix":
+        reader, writer = await asyncio.open_unix_connection(args.path, limit=1 << 20)
+    else:
+        raise ValueError("--consume работает только с tcp и unix")
+
+    marker = b'"sendTs":'
+    received = 0
+    latencies = []
+    started = time.monotonic()
+    with stage("consume") as m:
+        try:
+            while True:
+                if args.duration is not None and time.monotonic() - started >= args.duration:
+                    break
+                line = await reader.readline()
+                if not line:
+                    break
+                received += 1
+                # Задержку меряем по каждой 100-й строке, чтобы не тормозить приём
+                if received % 100 == 1:
+                    position = line.find(marker) + len(marker)
+                    send_ts = float(line[position:line.index(b",", position)])
+                    latencies.append(time.time() - send_ts)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            pass
+        finally:
+            m.add_rows(received)
+            writer.close()
+    elapsed = max(time.monotonic() - started, 1e-9)
+    latency = percentiles(latencies)
+    print(f"✅ Принято {received:,} котировок за {elapsed:.2f} с — {received / elapsed:,.0f} котировок/с; "
+          f"задержка p50 {latency[50] * 1000:.2f} мс, p99 {latency[99] * 1000:.2f} мс", file=sys.stderr)
+    return received
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Потоковая выдача котировок (нагрузочный генератор)")
+    parser.add_argument("--consume", action="store_true", help="Запустить тестового потребителя")
+    parser.add_argument("--transport", choices=("tcp", "unix", "stdout"), default="tcp")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--path", default="/tmp/quotes.sock", help="Путь Unix-сокета")
+    parser.add_argument("--source", choices=("generate", "replay"), default="generate")
+    parser.add_argument("--dir", default=".", help="Каталог с database_*.parquet для replay")
+    parser.add_argument("--files", nargs="+", help="Файлы для replay (вместо --dir)")
+    parser.add_argument("--loop", action="store_true", help="Повторять replay по кругу")
+    parser.add_argument("--symbols", nargs="+", default=DEFAULT_SYMBOLS, help="Символы для генерации")
+    parser.add_argument("--seed", type=int, help="Seed генератора")
+    parser.add_argument("--rate", type=float, default=10000, help="Котировок в секунду (0 — без ограничения)")
+    parser.add_argument("--batch", type=int, default=1000, help="Котировок в пачке")
+    parser.add_argument("--count", type=int, help="Остановиться после N котировок")
+    parser.add_argument("--duration", type=float, help="Остановиться через N секунд")
+    parser.add_argument("--buffer", type=int, default=1 << 20, help="Буфер записи на потребителя, байт")
+    parser.add_argument("--report-interval", type=float, default=5.0,
+                        help="Период промежуточной статистики, с (0 — только итог)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        asyncio.run(consume(args) if args.consume else serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Чтение Parquet-объектов из OBS_BUCKET по диапазонам байт (HTTP Range).
+
+Файл в бакете не скачивается целиком: pyarrow сначала читает футер,
+затем только чанки нужных колонок в тех row group'ах, которые не
+отсеяны статистикой по фильтрам. Под ним лежит блочный кэш: блоки
+фиксированного размера хранятся в памяти (LRU) и на диске
+(.remote_cache/<объект>/<ETag>/), так что изменённый объект не
+прочитается из устаревшего кэша, а блоки прежних версий удаляются при
+открытии. Объём дискового кэша ограничен REMOTE_CACHE_MAX_MB (по
+умолчанию 512): сверх него удаляются давно не использованные блоки.
+Соседние недостающие блоки запрашиваются одним GET.
+
+Каждый GET идёт с If-Match на ETag, полученный при открытии: если объект
+перезаписали посреди чтения (так делает загрузка консолидированной базы),
+S3 отвечает 412, и чтение начинается заново уже по новой версии — блоки
+разных версий никогда не смешиваются ни в результате, ни в кэше.
+
+Примеры:
+
+    python remote_parquet.py --list
+    python remote_parquet.py consolidated_database_2025-10-13.parquet \\
+        --columns symbol rateId --filter symbol = USD/RUB
+
+Проверка на moto server / MinIO: --endpoint http://127.0.0.1:5000 --bucket test
+"""
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from cloud_upload import with_retries
+
+BLOCK_SIZE = 1024 * 1024
+MEMORY_BLOCKS = 64
+CACHE_DIR = ".remote_cache"
+REOPEN_ATTEMPTS = 3
+
+
+class ObjectChanged(Exception):
+    """Объект в бакете заменён новой версией во время чтения"""
+
+
+def _is_precondition_failed(error):
+    response = getattr(error, "response", None) or {}
+    return (response.get("Error", {}).get("Code") == "PreconditionFailed"
+            or response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 412)
+
+
+def _cache_limit():
+    return int(os.getenv("REMOTE_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+
+def trim_cache(cache_dir=CACHE_DIR, max_bytes=None):
+    """Удаляет давно не использованные блоки, пока кэш больше max_bytes"""
+    max_bytes = _cache_limit() if max_bytes is None else max_bytes
+    blocks = []
+    for root, _, files in os.walk(cache_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            blocks.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in blocks)
+    for _, size, path in sorted(blocks):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    # Пустые каталоги версий и объектов
+    for root, dirs, files in os.walk(cache_dir, topdown=False):
+        if root != cache_dir and not dirs and not files:
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+    return total
+
+
+class RangeReader(io.RawIOBase):
+    """Файлоподобный объект поверх S3-объекта с блочным кэшем"""
+
+    def __init__(self, client, bucket, key, block_size=BLOCK_SIZE, cache_dir=CACHE_DIR,
+                 memory_blocks=MEMORY_BLOCKS):
+        super().__init__()
+        head = with_retries(client.head_object, Bucket=bucket, Key=key, description=f"head_object {key}")
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = head["ContentLength"]
+        self.etag = head.get("ETag", "").strip('"')
+        self.block_size = block_size
+        self.memory_blocks = memory_blocks
+        self.cache_root = cache_dir
+        self.cache_dir = None
+        if cache_dir:
+            object_dir = os.path.join(cache_dir, hashlib.sha1(f"{bucket}/{key}".encode()).hexdigest())
+            version = hashlib.sha1(self.etag.encode()).hexdigest()[:16]
+            self.cache_dir = os.path.join(object_dir, version)
+            # Блоки прежних версий объекта больше не пригодятся
+            if os.path.isdir(object_dir):
+                for old in os.listdir(object_dir):
+                    if old != version:
+                        shutil.rmtree(os.path.join(object_dir, old), ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self._blocks = OrderedDict()
+        self._position = 0
+        self._lock = threading.Lock()
+        self.changed = False
+        # Статистика: сколько байт и запросов ушло в сеть
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        return self._position
+
+    def readinto(self, buffer):
+        with self._lock:
+            start = self._position
+            end = min(self.size, start + len(buffer))
+            if start >= end:
+                return 0
+            data = self._read_range(start, end)
+            buffer[:len(data)] = data
+            self._position = end
+            return len(data)
+
+    # --- Блочный кэш ---
+
+    def _cached_block(self, index):
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+            return block
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, str(index))
+            try:
+                with open(path, "rb") as f:
+                    block = f.read()
+            except FileNotFoundError:
+                return None
+            # mtime — время последнего использования для trim_cache
+            os.utime(path)
+            self._remember(index, block)
+            return block
+        return None
+
+    def _remember(self, index, block):
+        self._blocks[index] = block
+        self._blocks.move_to_end(index)
+        while len(self._blocks) > self.memory_blocks:
+            self._blocks.popitem(last=False)
+
+    def _store(self, index, block):
+        self._remember(index, block)
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, str(index))
+            tmp_path = f"{path}.tmp{threading.get_ident()}"
+            try:
+                # trim_cache мог удалить опустевший каталог версии
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    f.write(block)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️ Не удалось сохранить блок {index} в кэш: {e}")
+
+    def _fetch(self, first, last):
+        """Один GET на непрерывный диапазон блоков first..last; возвращает {номер: блок}"""
+        start = first * self.block_size
+        end = min(self.size, (last + 1) * self.block_size) - 1
+        condition = {"IfMatch": f'"{self.etag}"'} if self.etag else {}
+        try:
+            response = with_retries(self.client.get_object, Bucket=self.bucket, Key=self.key,
+                                    Range=f"bytes={start}-{end}", description=f"get_object {self.key}",
+                                    **condition)
+        except Exception as e:
+            if not _is_precondition_failed(e):
+                raise
+            # pyarrow может обернуть исключение в своё — флаг сохраняет причину
+            self.changed = True
+            raise ObjectChanged(f"{self.key}: объект изменился во время чтения") from e
+        data = response["Body"].read()
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        blocks = {}
+        for index in range(first, last + 1):
+            offset = (index - first) * self.block_size
+            blocks[index] = data[offset:offset + self.block_size]
+            self._store(index, blocks[index])
+        if self.cache_dir:
+            trim_cache(self.cache_root)
+        return blocks
+
+    def _read_range(self, start, end):
+        first, last = start // self.block_size, (end - 1) // self.block_size
+        blocks = {index: self._cached_block(index) for index in range(first, last + 1)}
+        missing = [index for index, block in blocks.items() if block is None]
+        # Склеиваем соседние недостающие блоки в один запрос
+        run_start = None
+        for i, index in enumerate(missing):
+            if run_start is None:
+                run_start = index
+            if i + 1 == len(missing) or missing[i + 1] != index + 1:
+                # LRU мог уже вытеснить часть этих блоков — берём их из ответа
+                blocks.update(self._fetch(run_start, index))
+                run_start = None
+        data = b"".join(blocks[index] for index in range(first, last + 1))
+        offset = start - first * self.block_size
+        return data[offset:offset + (end - start)]
+
+
+def _default_client_and_bucket(client, bucket):
+    if client is None:
+        from cloud_upload import make_s3_client
+        client = make_s3_client()
+    if bucket is None:
+        from cloud_settings import get_obs_settings
+        bucket = get_obs_settings()["OBS_BUCKET"]
+    return client, bucket
+
+
+def list_remote(prefix="", client=None, bucket=None):
+    """Список объектов бакета: [(ключ, размер)]"""
+    client, bucket = _default_client_and_bucket(client, bucket)
+    objects = []
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            objects.append((item["Key"], item["Size"]))
+    return objects
+
+
+def _read_with_reopen(client, bucket, key, read, **reader_options):
+    """read(source) по свежему RangeReader; при замене объекта — заново"""
+    import pyarrow as pa
+
+    for attempt in range(REOPEN_ATTEMPTS):
+        reader = RangeReader(client, bucket, key, **reader_options)
+        source = pa.PythonFile(reader, mode="r")
+        try:
+            return read(source), reader
+        except Exception:
+            if not reader.changed or attempt + 1 >= REOPEN_ATTEMPTS:
+                raise
+            print(f"🔄 {key}: объект изменился во время чтения, открываем заново")
+        finally:
+            source.close()
+
+
+def read_remote_parquet(key, columns=None, filters=None, client=None, bucket=None,
+                        block_size=BLOCK_SIZE, cache_dir=CACHE_DIR):
+    """Читает из бакета только нужные колонки и row group'ы Parquet-объекта.
+
+    filters — в формате pyarrow (например [("symbol", "=", "USD/RUB")]);
+    row group'ы отсеиваются по статистике футера ещё до загрузки данных.
+    Возвращает (pyarrow.Table, RangeReader со статистикой запросов).
+    """
+    import pyarrow.parquet as pq
+
+    client, bucket = _default_client_and_bucket(client, bucket)
+    return _read_with_reopen(client, bucket, key,
+                             lambda source: pq.read_table(source, columns=columns, filters=filters),
+                             block_size=block_size, cache_dir=cache_dir)
+
+
+def remote_metadata(key, client=None, bucket=None, cache_dir=CACHE_DIR):
+    """Метаданные футера (схема, row group'ы, статистика) без чтения данных"""
+    import pyarrow.parquet as pq
+
+    client, bucket = _default_client_and_bucket(client, bucket)
+    metadata, _ = _read_with_reopen(client, bucket, key, lambda source: pq.ParquetFile(source).metadata,
+                                    cache_dir=cache_dir)
+    return metadata
+
+
+def _parse_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            continue
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Чтение Parquet из бакета по диапазонам байт")
+    parser.add_argument("key", nargs="?", help="Ключ объекта")
+    parser.add_argument("--list", action="store_true", help="Показать Parquet-объекты бакета")
+    parser.add_argument("--columns", nargs="+", help="Колонки для чтения")
+    parser.add_argument("--filter", nargs=3, action="append", metavar=("COL", "OP", "VALUE"),
+                        help="Фильтр, например: --filter symbol = USD/RUB")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать дисковый кэш")
+    parser.add_argument("--endpoint", help="Локальный S3 (moto/MinIO) вместо OBS из окружения")
+    parser.add_argument("--bucket", help="Бакет (для --endpoint или вместо OBS_BUCKET)")
+    args = parser.parse_args()
+
+    client = None
+    if args.endpoint:
+        import boto3
+        client = boto3.client("s3", endpoint_url=args.endpoint, region_name="us-east-1",
+                              aws_access_key_id="test", aws_secret_access_key="test")
+    bucket = args.bucket or ("test" if args.endpoint else None)
+
+    if args.list or not args.key:
+        for key, size in list_remote(client=client, bucket=bucket):
+            if key.endswith(".parquet"):
+                print(f"{size:>14}  {key}")
+        return
+
+    filters = [(col, op, _parse_value(value)) for col, op, value in args.filter] if args.filter else None
+    table, reader = read_remote_parquet(args.key, args.columns, filters, client=client, bucket=bucket,
+                                        cache_dir=None if args.no_cache else CACHE_DIR)
+    print(f"📊 {args.key}: {table.num_rows} строк, колонки {table.column_names}")
+    print(f"   Из сети: {reader.bytes_fetched} из {reader.size} байт за {reader.requests} запросов")
+    print(table.slice(0, 3).to_pandas())
+
+
+if __name__ == "__main__":
+    main()
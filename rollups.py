@@ -0,0 +1,356 @@
+"""Инкрементально обновляемые агрегаты (rollups) по котировкам.
+
+Для каждой корзины времени (минута, час) и ключа symbol/tenor/tier
+хранится OHLC по bid и ask, сумма/минимум/максимум спреда, суммы
+размеров, количество tradable/indicative котировок и число строк.
+Средние и доли считаются при чтении (load_rollup).
+
+Агрегат разбит на партиции по дням: rollups/<корзина>/<день>.<метка>.parquet.
+Манифест rollups/<корзина>/_manifest.json перечисляет текущие партиции
+и уже учтённые исходные файлы, поэтому при обновлении читаются только
+новые database_*.parquet и переписываются только те дни, которые
+затронули новые строки. Новые партиции пишутся под новыми именами,
+после чего манифест атомарно заменяется (os.replace) — прерванное
+обновление оставляет лишь файлы-сироты, которые удалит следующий запуск.
+Заменённые партиции и сироты удаляются не сразу, а через ORPHAN_GRACE
+секунд: читатель, успевший прочитать прежний манифест, дочитает свои
+файлы. Обновления (демон ingest_watcher.py и ручной запуск) выполняются
+по одному под блокировкой rollups/.lock.
+Исходный файл учитывается по ключу
+storage.file_identity (имя, число строк, диапазон ulid), а не только по
+имени: файл, получивший имя уже слитого компактизацией исходника, будет
+учтён. Файлы после компактизации (compaction.py) содержат колонку
+source_file и ключи исходников в метаданных, и уже учтённые строки
+не считаются дважды. Полный проход по каталогу (python rollups.py)
+убирает из манифеста ключи файлов, которых больше нет (например,
+удалённых по сроку хранения).
+
+Примеры:
+
+    python rollups.py                 # обновить все агрегаты
+    python rollups.py --show 1h       # показать часовой агрегат
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from metrics import stage
+from storage import file_identity, source_identities, write_parquet
+
+ROLLUPS = {"1min": "1min", "1h": "1h"}
+KEYS = ["symbol", "tenor", "tier", "bucket"]
+MANIFEST = "_manifest.json"
+LOCK_FILE = ".lock"
+DEFAULT_DIR = "rollups"
+# Сколько секунд заменённая партиция остаётся на диске для текущих читателей
+ORPHAN_GRACE = 600
+
+
+def _partition_dir(name, rollup_dir):
+    return os.path.join(rollup_dir, name)
+
+
+def _write_manifest(manifest, name, rollup_dir):
+    path = os.path.join(_partition_dir(name, rollup_dir), MANIFEST)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_partition(df, name, rollup_dir, day):
+    """Пишет партицию под новым именем; возвращает (имя файла, размер)"""
+    import pyarrow as pa
+
+    file = f"{day}.{uuid.uuid4().hex[:8]}.parquet"
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return file, write_parquet(table, os.path.join(_partition_dir(name, rollup_dir), file))
+
+
+def _read_partition(name, rollup_dir, file, filters=None):
+    import pyarrow.parquet as pq
+
+    return pq.read_table(os.path.join(_partition_dir(name, rollup_dir), file), filters=filters)
+
+
+@contextmanager
+def _update_lock(rollup_dir):
+    """Эксклюзивная блокировка каталога агрегатов на время обновления"""
+    with open(os.path.join(rollup_dir, LOCK_FILE), "a") as f:
+        try:
+            import fcntl
+        except ImportError:
+            # Не POSIX: блокировки нет, обновления не должны идти параллельно
+            yield
+            return
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _remove_orphans(manifest, name, rollup_dir, grace=ORPHAN_GRACE):
+    """Удаляет партиции, не попавшие в манифест, старше grace секунд.
+
+    Заменённые партиции отсчитывают grace от момента замены (manifest["retired"]),
+    брошенные прерванными запусками — от времени записи файла.
+    """
+    directory = _partition_dir(name, rollup_dir)
+    live = set(manifest["partitions"].values())
+    retired = manifest.get("retired", {})
+    now = time.time()
+    for file in os.listdir(directory):
+        if not file.endswith(".parquet") or file in live:
+            continue
+        path = os.path.join(directory, file)
+        try:
+            since = retired.get(file) or os.path.getmtime(path)
+            if now - since >= grace:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+    # Удалённые файлы больше не нужно помнить
+    manifest["retired"] = {file: since for file, since in retired.items()
+                           if os.path.exists(os.path.join(directory, file))}
+
+
+def _read_manifest(name, rollup_dir):
+    """Манифест агрегата: {"sources": [...], "partitions": {день: файл}}"""
+    directory = _partition_dir(name, rollup_dir)
+    path = os.path.join(directory, MANIFEST)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    os.makedirs(directory, exist_ok=True)
+    return {"sources": [], "partitions": {}}
+
+
+def _read_new_rows(path, name):
+    """Строки файла в виде «агрегатов из одной строки» и их исходные файлы"""
+    import pandas as pd
+    import pyarrow.parquet as pq
+    from price_levels import price_columns
+
+    table = pq.read_table(path)
+    prices = price_columns(table).to_pandas()
+    df = pd.DataFrame({
+        "symbol": table["symbol"].to_pandas(),
+        "tenor": table["tenor"].to_pandas(),
+        "tier": table["tier"].to_pandas(),
+        "time": pd.to_datetime(table["time"].to_pandas(), format="%Y-%m-%dT%H:%M:%SZ", utc=True),
+        "tradable": table["globalTradable"].to_pandas(),
+        "indicative": table["globalIndicative"].to_pandas(),
+    })
+    if "source_file" in table.column_names:
+        identities = source_identities(table.schema)
+        sources = table["source_file"].to_pandas().fillna(name)
+        df["origin"] = sources.map(lambda source: identities.get(source, source))
+    else:
+        df["origin"] = file_identity(path)
+    return pd.concat([df, prices], axis=1)
+
+
+def _file_origins(path, schema):
+    """Ключи исходных файлов, строки которых содержит файл"""
+    import pyarrow.parquet as pq
+
+    if "source_file" not in schema.names:
+        return {file_identity(path)}
+    identities = source_identities(schema)
+    sources = pq.read_table(path, columns=["source_file"])["source_file"].unique().to_pylist()
+    return {identities.get(source, source) for source in sources}
+
+
+def _to_single_row_aggregates(rows, freq):
+    """Каждая котировка как агрегат из одной строки — тот же формат, что и rollup"""
+    import pandas as pd
+
+    spread = rows["ask_price"] - rows["bid_price"]
+    return pd.DataFrame({
+        "symbol": rows["symbol"],
+        "tenor": rows["tenor"],
+        "tier": rows["tier"],
+        "bucket": rows["time"].dt.floor(freq),
+        "open_time": rows["time"],
+        "close_time": rows["time"],
+        "bid_open": rows["bid_price"],
+        "bid_high": rows["bid_price"],
+        "bid_low": rows["bid_price"],
+        "bid_close": rows["bid_price"],
+        "ask_open": rows["ask_price"],
+        "ask_high": rows["ask_price"],
+        "ask_low": rows["ask_price"],
+        "ask_close": rows["ask_price"],
+        "spread_sum": spread,
+        "spread_min": spread,
+        "spread_max": spread,
+        "bid_size_sum": rows["bid_size"],
+        "ask_size_sum": rows["ask_size"],
+        "tradable_count": rows["tradable"],
+        "indicative_count": rows["indicative"],
+        "count": 1,
+    })
+
+
+def combine(parts):
+    """Сливает агрегаты с одинаковыми ключами (ассоциативно, в любом порядке)"""
+    df = parts.dropna(subset=["bid_open", "ask_open"])
+    grouped = df.groupby(KEYS, dropna=False, sort=True)
+    out = grouped.agg(
+        open_time=("open_time", "min"),
+        close_time=("close_time", "max"),
+        bid_high=("bid_high", "max"),
+        bid_low=("bid_low", "min"),
+        ask_high=("ask_high", "max"),
+        ask_low=("ask_low", "min"),
+        spread_sum=("spread_sum", "sum"),
+        spread_min=("spread_min", "min"),
+        spread_max=("spread_max", "max"),
+        bid_size_sum=("bid_size_sum", "sum"),
+        ask_size_sum=("ask_size_sum", "sum"),
+        tradable_count=("tradable_count", "sum"),
+        indicative_count=("indicative_count", "sum"),
+        count=("count", "sum"),
+    )
+    # open — значение с самым ранним временем, close — с самым поздним
+    by_open = df.sort_values("open_time", kind="stable").groupby(KEYS, dropna=False, sort=True)
+    by_close = df.sort_values("close_time", kind="stable").groupby(KEYS, dropna=False, sort=True)
+    out[["bid_open", "ask_open"]] = by_open[["bid_open", "ask_open"]].first()
+    out[["bid_close", "ask_close"]] = by_close[["bid_close", "ask_close"]].last()
+    columns = ["open_time", "close_time",
+               "bid_open", "bid_high", "bid_low", "bid_close",
+               "ask_open", "ask_high", "ask_low", "ask_close",
+               "spread_sum", "spread_min", "spread_max",
+               "bid_size_sum", "ask_size_sum", "tradable_count", "indicative_count", "count"]
+    return out[columns].reset_index()
+
+
+def update_rollups(directory=".", rollup_dir=DEFAULT_DIR, rollups=None, files=None):
+    """Добавляет в агрегаты строки ещё не учтённых database_*.parquet файлов
+
+    files — имена файлов в directory; по умолчанию просматривается весь каталог
+    """
+    rollups = rollups or ROLLUPS
+    os.makedirs(rollup_dir, exist_ok=True)
+    with _update_lock(rollup_dir):
+        return _update_locked(directory, rollup_dir, rollups, files)
+
+
+def _update_locked(directory, rollup_dir, rollups, files):
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    state = {name: _read_manifest(name, rollup_dir) for name in rollups}
+    for name, manifest in state.items():
+        _remove_orphans(manifest, name, rollup_dir)
+    known = set.intersection(*(set(manifest["sources"]) for manifest in state.values()))
+
+    # При полном проходе по каталогу известны ключи всех живых файлов:
+    # ключи удалённых (срок хранения) из манифеста убираются
+    present = None
+    if files is None:
+        from ingest_watcher import data_files
+        files = data_files(directory)
+        present = set()
+    new_rows = []
+    with stage("rollup_read") as m:
+        for file in files:
+            path = os.path.join(directory, file)
+            try:
+                origins = _file_origins(path, pq.read_schema(path))
+                if present is not None:
+                    present |= origins
+                # Уже учтённые файлы не читаем: ключ берётся из футера
+                if origins <= known:
+                    continue
+                rows = _read_new_rows(path, file)
+            except Exception as e:
+                print(f"❌ Ошибка при чтении файла {file}: {e}")
+                # Ключи нечитаемого файла неизвестны — ничего не удаляем
+                present = None
+                continue
+            new_rows.append(rows)
+            m.add_rows(len(rows))
+            m.add_file(path)
+
+    rows = pd.concat(new_rows, ignore_index=True) if new_rows else None
+    for name, freq in rollups.items():
+        manifest = state[name]
+        sources = set(manifest["sources"])
+        fresh = rows[~rows["origin"].isin(sources)] if rows is not None else None
+        if fresh is None or fresh.empty:
+            if present is not None and not sources <= present:
+                manifest["sources"] = sorted(sources & present)
+                _write_manifest(manifest, name, rollup_dir)
+                print(f"🗑️ Агрегат {name}: забыто удалённых файлов {len(sources - present)}")
+            continue
+        with stage("rollup_update", rows=len(fresh), rollup=name) as m:
+            aggregates = _to_single_row_aggregates(fresh, freq)
+            partitions = dict(manifest["partitions"])
+            retired = dict(manifest.get("retired", {}))
+            # Переписываем только дни, в которые попали новые строки
+            touched = aggregates.groupby(aggregates["bucket"].dt.strftime("%Y-%m-%d"))
+            for day, part in touched:
+                parts = [part]
+                if day in partitions:
+                    parts.insert(0, _read_partition(name, rollup_dir, partitions[day]).to_pandas())
+                    retired[partitions[day]] = time.time()
+                merged = combine(pd.concat(parts, ignore_index=True))
+                partitions[day], size = _write_partition(merged, name, rollup_dir, day)
+                m.add_bytes(size)
+            sources |= set(fresh["origin"].unique())
+            if present is not None:
+                sources &= present
+            manifest = {"sources": sorted(sources), "partitions": partitions, "retired": retired}
+            _write_manifest(manifest, name, rollup_dir)
+        print(f"✅ Агрегат {name}: +{len(fresh)} строк, обновлено дней {touched.ngroups} из {len(partitions)}")
+
+    if rows is None:
+        print("ℹ️ Новых файлов для агрегатов нет")
+        return 0
+    return len(rows)
+
+
+def load_rollup(name, rollup_dir=DEFAULT_DIR, symbol=None):
+    """Читает агрегат и добавляет производные показатели (средний спред, доли)"""
+    import pyarrow as pa
+
+    manifest = _read_manifest(name, rollup_dir)
+    if not manifest["partitions"]:
+        raise FileNotFoundError(f"Агрегат {name} ещё не построен в {rollup_dir}")
+    filters = [("symbol", "=", symbol)] if symbol else None
+    tables = [_read_partition(name, rollup_dir, file, filters)
+              for _, file in sorted(manifest["partitions"].items())]
+    df = pa.concat_tables(tables).to_pandas()
+    df["avg_spread"] = df["spread_sum"] / df["count"]
+    df["avg_bid_size"] = df["bid_size_sum"] / df["count"]
+    df["avg_ask_size"] = df["ask_size_sum"] / df["count"]
+    df["tradable_ratio"] = df["tradable_count"] / df["count"]
+    df["indicative_ratio"] = df["indicative_count"] / df["count"]
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Инкрементальные агрегаты по котировкам")
+    parser.add_argument("--dir", default=".", help="Каталог с database_*.parquet")
+    parser.add_argument("--rollup-dir", default=DEFAULT_DIR, help="Каталог агрегатов")
+    parser.add_argument("--show", choices=sorted(ROLLUPS), help="Показать агрегат вместо обновления")
+    parser.add_argument("--symbol", help="Фильтр по символу для --show")
+    args = parser.parse_args()
+
+    if args.show:
+        df = load_rollup(args.show, args.rollup_dir, args.symbol)
+        print(f"📊 Агрегат {args.show}: {len(df)} корзин")
+        print(df.head(10))
+    else:
+        update_rollups(args.dir, args.rollup_dir)
+
+
+if __name__ == "__main__":
+    main()
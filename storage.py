@@ -0,0 +1,312 @@
+"""Запись табличных файлов: Parquet (с настраиваемым сжатием), Arrow IPC, CSV, Excel.
+
+Параметры по умолчанию берутся из переменных окружения:
+
+    PARQUET_COMPRESSION        кодек: snappy (по умолчанию), zstd, gzip, brotli, lz4, none
+    PARQUET_COMPRESSION_LEVEL  уровень сжатия (например, 1..22 для zstd; у snappy уровней нет)
+    PARQUET_DICTIONARY         1/0 — словарное кодирование (по умолчанию 1)
+    PARQUET_BYTE_STREAM_SPLIT  1/0 — BYTE_STREAM_SPLIT для числовых колонок (по умолчанию 0)
+
+Любой параметр можно переопределить при вызове write_parquet(...)
+или через словарь parquet_options у функций create_*.
+"""
+import os
+
+# Кодировки, которые pyarrow принимает в column_encoding
+COLUMN_ENCODINGS = ("PLAIN", "BYTE_STREAM_SPLIT", "DELTA_BINARY_PACKED",
+                    "DELTA_LENGTH_BYTE_ARRAY", "DELTA_BYTE_ARRAY")
+
+
+def _env_flag(name, default):
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def default_parquet_options():
+    """Параметры записи Parquet, заданные через окружение"""
+    level = os.getenv("PARQUET_COMPRESSION_LEVEL")
+    return {
+        "compression": os.getenv("PARQUET_COMPRESSION", "snappy"),
+        "compression_level": int(level) if level else None,
+        "use_dictionary": _env_flag("PARQUET_DICTIONARY", True),
+        "byte_stream_split": _env_flag("PARQUET_BYTE_STREAM_SPLIT", False),
+        "column_encoding": None,
+    }
+
+
+def _numeric_columns(schema):
+    import pyarrow.types as pat
+    return [field.name for field in schema
+            if pat.is_integer(field.type) or pat.is_floating(field.type)]
+
+
+_warned = set()
+
+
+def _warn_once(message):
+    # Файлов в одном запуске много — предупреждаем один раз
+    if message not in _warned:
+        _warned.add(message)
+        print(message)
+
+
+def _supports_level(codec):
+    import pyarrow as pa
+    try:
+        return pa.Codec.supports_compression_level(codec)
+    except (ValueError, TypeError):
+        return False
+
+
+def _compression_level(codec, level):
+    """Уровень сжатия только для кодеков, у которых он есть.
+
+    pyarrow отказывается писать файл, если уровень задан для snappy,
+    поэтому для таких кодеков (и колонок с ними) уровень отбрасывается
+    с предупреждением.
+    """
+    if level is None or codec is None:
+        return None
+    if isinstance(codec, dict):
+        levels = {}
+        for col, col_codec in codec.items():
+            col_level = level.get(col) if isinstance(level, dict) else level
+            if col_level is not None and _supports_level(col_codec):
+                levels[col] = col_level
+        dropped = sorted(set(level if isinstance(level, dict) else codec) - set(levels))
+        if dropped:
+            _warn_once(f"⚠️ Уровень сжатия не применяется к колонкам {', '.join(dropped)}: "
+                       f"их кодек не поддерживает уровни")
+        return levels or None
+    if not _supports_level(codec):
+        _warn_once(f"⚠️ Кодек {codec} не поддерживает уровень сжатия — compression_level={level} пропущен")
+        return None
+    return level
+
+
+def parquet_write_kwargs(schema, compression=None, compression_level=None, use_dictionary=None,
+                         byte_stream_split=None, column_encoding=None):
+    """Собирает аргументы pyarrow.parquet.write_table для данной схемы.
+
+    compression       — кодек или словарь {колонка: кодек}
+    compression_level — уровень сжатия (int или словарь {колонка: уровень})
+    use_dictionary    — True/False или список колонок со словарным кодированием
+    byte_stream_split — True (все числовые колонки), False или список колонок
+    column_encoding   — словарь {колонка: кодировка из COLUMN_ENCODINGS}
+
+    Колонки с BYTE_STREAM_SPLIT или явной кодировкой автоматически
+    исключаются из словарного кодирования, иначе pyarrow их не применит.
+    """
+    options = default_parquet_options()
+    overrides = {
+        "compression": compression,
+        "compression_level": compression_level,
+        "use_dictionary": use_dictionary,
+        "byte_stream_split": byte_stream_split,
+        "column_encoding": column_encoding,
+    }
+    options.update({k: v for k, v in overrides.items() if v is not None})
+
+    names = list(schema.names)
+    numeric = _numeric_columns(schema)
+
+    bss = options["byte_stream_split"]
+    if bss is True:
+        bss = numeric
+    elif not bss:
+        bss = []
+    bss = [c for c in bss if c in names]
+
+    encoding = dict(options["column_encoding"] or {})
+    for col, enc in encoding.items():
+        if enc not in COLUMN_ENCODINGS:
+            raise ValueError(f"Неизвестная кодировка {enc} для колонки {col}")
+    # BYTE_STREAM_SPLIT задаём через column_encoding, если он уже используется
+    if encoding:
+        for col in bss:
+            encoding.setdefault(col, "BYTE_STREAM_SPLIT")
+        bss = []
+
+    dictionary = options["use_dictionary"]
+    special = set(bss) | set(encoding)
+    if special:
+        if dictionary is True:
+            dictionary = [c for c in names if c not in special]
+        elif dictionary:
+            dictionary = [c for c in dictionary if c not in special]
+        if not dictionary:
+            dictionary = False
+
+    codec = options["compression"]
+    if isinstance(codec, str) and codec.lower() == "none":
+        codec = None
+
+    kwargs = {
+        "compression": codec,
+        "use_dictionary": dictionary,
+    }
+    level = _compression_level(codec, options["compression_level"])
+    if level is not None:
+        kwargs["compression_level"] = level
+    if bss:
+        kwargs["use_byte_stream_split"] = bss
+    if encoding:
+        kwargs["column_encoding"] = encoding
+    return kwargs
+
+
+def write_parquet(data, path, **options):
+    """Записывает DataFrame или pyarrow.Table в Parquet с заданным сжатием.
+
+    Возвращает размер получившегося файла в байтах.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if isinstance(data, pa.Table):
+        table = data
+    else:
+        table = pa.Table.from_pandas(data, preserve_index=False)
+    pq.write_table(table, path, **parquet_write_kwargs(table.schema, **options))
+    return os.path.getsize(path)
+
+
+def write_arrow(data, path, compression="uncompressed"):
+    """Записывает Arrow IPC (Feather v2). По умолчанию без сжатия,
+    чтобы файл можно было читать через mmap без копирования.
+
+    Файл пишется рядом во временный и подменяется через os.replace:
+    перезапись на месте обрезала бы страницы, которые read_arrow уже
+    отобразил в память, и читатель получил бы SIGBUS.
+
+    Возвращает размер файла в байтах.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        feather.write_feather(table, tmp_path, compression=compression)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return os.path.getsize(path)
+
+
+def read_arrow(path, columns=None):
+    """Открывает Arrow IPC файл через mmap и возвращает pyarrow.Table.
+
+    Буферы таблицы ссылаются прямо на отображённые страницы файла:
+    повторное открытие — это попадание в page cache, без декодирования
+    и копирования. Файл должен быть записан без сжатия (см. write_arrow).
+    """
+    import pyarrow as pa
+
+    source = pa.memory_map(path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def read_arrow_df(path, columns=None):
+    """То же, что read_arrow, но возвращает DataFrame.
+
+    Числовые колонки без пропусков остаются представлениями над mmap
+    (split_blocks=True не склеивает их в общий блок); строковые колонки
+    pandas всё равно материализует в объекты Python.
+    """
+    return read_arrow(path, columns).to_pandas(split_blocks=True)
+
+
+def arrow_path_for(parquet_path):
+    """Имя Arrow IPC файла рядом с Parquet: x.parquet -> x.arrow"""
+    root, _ = os.path.splitext(parquet_path)
+    return f"{root}.arrow"
+
+
+def write_csv(data, path):
+    """Записывает CSV через pyarrow; возвращает размер файла в байтах"""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+    pa_csv.write_csv(table, path)
+    return os.path.getsize(path)
+
+
+# Ширина колонок Excel для формата котировок
+EXCEL_COLUMN_WIDTHS = {
+    'A': 20, 'B': 30, 'C': 12, 'D': 8, 'E': 8, 'F': 20,
+    'G': 15, 'H': 18, 'I': 15, 'J': 10, 'K': 50
+}
+
+
+def write_excel(df, path, sheet_name="Sheet1"):
+    """Записывает DataFrame в Excel с настроенной шириной колонок"""
+    import pandas as pd
+
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name=sheet_name, index=False)
+        worksheet = writer.sheets[sheet_name]
+        for col, width in EXCEL_COLUMN_WIDTHS.items():
+            worksheet.column_dimensions[col].width = width
+    return os.path.getsize(path)
+
+
+# Метаданные компактизированных файлов: {source_file: ключ исходного файла}
+SOURCE_IDENTITIES_KEY = b"source_identities"
+
+
+def file_identity(path):
+    """Ключ исходного Parquet файла для учёта его строк в агрегатах.
+
+    Имя + число строк + диапазон ulid из статистики футера (данные не
+    читаются): новый файл под переиспользованным именем даёт другой ключ,
+    а перезапись тех же строк (например, migrate_price_levels.py) — тот же.
+    Без статистики ulid — имя, размер и mtime.
+    """
+    import pyarrow.parquet as pq
+
+    name = os.path.basename(path)
+    metadata = pq.read_metadata(path)
+    names = metadata.schema.to_arrow_schema().names
+    if "ulid" in names:
+        position = names.index("ulid")
+        minimums, maximums = [], []
+        for i in range(metadata.num_row_groups):
+            stats = metadata.row_group(i).column(position).statistics
+            if stats is None or not stats.has_min_max:
+                break
+            minimums.append(stats.min)
+            maximums.append(stats.max)
+        else:
+            if minimums:
+                return f"{name}:{metadata.num_rows}:{min(minimums)}:{max(maximums)}"
+    stat = os.stat(path)
+    return f"{name}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def source_identities(schema):
+    """{source_file: ключ} из метаданных компактизированного файла"""
+    import json
+
+    raw = (schema.metadata or {}).get(SOURCE_IDENTITIES_KEY)
+    return json.loads(raw) if raw else {}
+
+
+def compacted_sources(path):
+    """Имена исходных файлов, слитых compaction.py в данный файл"""
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(path)
+    sources = source_identities(schema)
+    if sources:
+        return list(sources)
+    if "source_file" in schema.names:
+        return pq.read_table(path, columns=["source_file"])["source_file"].unique().to_pylist()
+    return []
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BUCKET = "test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """boto3-клиент moto (S3 в памяти) с созданным бакетом BUCKET"""
+    pytest.importorskip("moto")
+    import boto3
+    from moto import mock_aws
+
+    import cloud_upload
+
+    # Без пауз между повторами
+    monkeypatch.setattr(cloud_upload, "backoff_delay", lambda attempt: 0)
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
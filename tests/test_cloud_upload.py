@@ -0,0 +1,90 @@
+"""Загрузка с повторами и возобновлением на moto (локальный S3 в памяти)."""
+import os
+
+import pytest
+
+import cloud_upload
+from cloud_upload import FaultInjectingClient, InjectedFault, read_checkpoint, resumable_upload
+from conftest import BUCKET
+
+PART_SIZE = 5 * 1024 * 1024  # минимум S3 для непоследней части
+
+
+@pytest.fixture
+def big_file(tmp_path):
+    path = tmp_path / "big.parquet"
+    path.write_bytes(os.urandom(2 * PART_SIZE + 1234))
+    return path
+
+
+def _object_bytes(client, key):
+    return client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def _open_uploads(client):
+    return client.list_multipart_uploads(Bucket=BUCKET).get("Uploads", [])
+
+
+def test_random_faults_are_retried(s3, big_file, tmp_path):
+    client = FaultInjectingClient(s3, fault_rate=0.3, seed=1)
+    resumable_upload(str(big_file), "big.parquet", client=client, bucket=BUCKET,
+                     part_size=PART_SIZE, checkpoint_dir=str(tmp_path / "ckpt"), max_attempts=20)
+    assert _object_bytes(s3, "big.parquet") == big_file.read_bytes()
+    assert read_checkpoint(BUCKET, "big.parquet", str(tmp_path / "ckpt")) is None
+
+
+def test_interrupted_upload_resumes_from_checkpoint(s3, big_file, tmp_path):
+    checkpoint_dir = str(tmp_path / "ckpt")
+    broken = FaultInjectingClient(s3, fail_after_parts=1)
+    with pytest.raises(InjectedFault):
+        resumable_upload(str(big_file), "big.parquet", client=broken, bucket=BUCKET,
+                         part_size=PART_SIZE, checkpoint_dir=checkpoint_dir, max_attempts=2)
+    checkpoint = read_checkpoint(BUCKET, "big.parquet", checkpoint_dir)
+    assert list(checkpoint["parts"]) == ["1"]
+
+    sent = resumable_upload(str(big_file), "big.parquet", client=s3, bucket=BUCKET,
+                            part_size=PART_SIZE, checkpoint_dir=checkpoint_dir)
+    # Первая часть повторно не отправлялась
+    assert sent == big_file.stat().st_size - PART_SIZE
+    assert _object_bytes(s3, "big.parquet") == big_file.read_bytes()
+    assert _open_uploads(s3) == []
+
+
+def test_stale_checkpoint_aborts_previous_upload(s3, big_file, tmp_path):
+    checkpoint_dir = str(tmp_path / "ckpt")
+    broken = FaultInjectingClient(s3, fail_after_parts=1)
+    with pytest.raises(InjectedFault):
+        resumable_upload(str(big_file), "big.parquet", client=broken, bucket=BUCKET,
+                         part_size=PART_SIZE, checkpoint_dir=checkpoint_dir, max_attempts=2)
+    stale_id = read_checkpoint(BUCKET, "big.parquet", checkpoint_dir)["upload_id"]
+
+    # Файл изменился — прежняя загрузка должна быть отменена, а не брошена
+    big_file.write_bytes(os.urandom(2 * PART_SIZE + 99))
+    resumable_upload(str(big_file), "big.parquet", client=s3, bucket=BUCKET,
+                     part_size=PART_SIZE, checkpoint_dir=checkpoint_dir)
+    assert _object_bytes(s3, "big.parquet") == big_file.read_bytes()
+    assert stale_id not in [u["UploadId"] for u in _open_uploads(s3)]
+    assert _open_uploads(s3) == []
+
+
+def test_list_parts_is_retried(s3, big_file, tmp_path, monkeypatch):
+    checkpoint_dir = str(tmp_path / "ckpt")
+    broken = FaultInjectingClient(s3, fail_after_parts=1)
+    with pytest.raises(InjectedFault):
+        resumable_upload(str(big_file), "big.parquet", client=broken, bucket=BUCKET,
+                         part_size=PART_SIZE, checkpoint_dir=checkpoint_dir, max_attempts=2)
+
+    calls = []
+    real_list_parts = cloud_upload._list_parts
+
+    def flaky_list_parts(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise InjectedFault("list_parts: случайный сбой")
+        return real_list_parts(*args, **kwargs)
+
+    monkeypatch.setattr(cloud_upload, "_list_parts", flaky_list_parts)
+    sent = resumable_upload(str(big_file), "big.parquet", client=s3, bucket=BUCKET,
+                            part_size=PART_SIZE, checkpoint_dir=checkpoint_dir)
+    assert len(calls) == 2
+    assert sent == big_file.stat().st_size - PART_SIZE
@@ -0,0 +1,95 @@
+"""Чтение Parquet из бакета по диапазонам байт на moto."""
+import io
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+
+from conftest import BUCKET
+from remote_parquet import read_remote_parquet, remote_metadata
+
+KEY = "consolidated_database_2025-10-13.parquet"
+BLOCK_SIZE = 16 * 1024
+SYMBOLS = ["CNY/RUB", "EUR/RUB", "INR/RUB", "USD/RUB"]
+
+
+def _table(rows_per_symbol=5000, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    rows = rows_per_symbol * len(SYMBOLS)
+    return pa.table({
+        # Символы идут блоками: статистика row group'ов отсекает чужие
+        "symbol": [s for s in SYMBOLS for _ in range(rows_per_symbol)],
+        "rateId": rng.integers(10000000000, 99999999999, rows),
+        "ulid": [f"{i:024X}" for i in rng.integers(0, 2 ** 62, rows)],
+        "bid_price": rng.integers(800000, 120000000, rows),
+    })
+
+
+def _upload(s3, table, key=KEY):
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=len(table) // len(SYMBOLS) // 2)
+    data = buffer.getvalue()
+    s3.put_object(Bucket=BUCKET, Key=key, Body=data)
+    return data
+
+
+def test_round_trip(s3, tmp_path):
+    table = _table()
+    _upload(s3, table)
+    remote, reader = read_remote_parquet(KEY, client=s3, bucket=BUCKET, block_size=BLOCK_SIZE,
+                                         cache_dir=str(tmp_path / "cache"))
+    assert remote.equals(table)
+    assert reader.requests > 0
+
+
+def test_projection_fetches_part_of_object(s3):
+    table = _table()
+    data = _upload(s3, table)
+    assert remote_metadata(KEY, client=s3, bucket=BUCKET, cache_dir=None).num_row_groups > 1
+
+    filters = [("symbol", "=", "USD/RUB")]
+    remote, reader = read_remote_parquet(KEY, columns=["symbol", "rateId"], filters=filters,
+                                         client=s3, bucket=BUCKET, block_size=BLOCK_SIZE, cache_dir=None)
+    expected = pq.read_table(io.BytesIO(data), columns=["symbol", "rateId"], filters=filters)
+    assert remote.equals(expected)
+    assert reader.bytes_fetched < reader.size
+
+
+def test_disk_cache_hit_issues_no_gets(s3, tmp_path):
+    _upload(s3, _table())
+    cache_dir = str(tmp_path / "cache")
+    first, reader = read_remote_parquet(KEY, columns=["rateId"], client=s3, bucket=BUCKET,
+                                        block_size=BLOCK_SIZE, cache_dir=cache_dir)
+    assert reader.requests > 0
+    second, reader = read_remote_parquet(KEY, columns=["rateId"], client=s3, bucket=BUCKET,
+                                         block_size=BLOCK_SIZE, cache_dir=cache_dir)
+    assert second.equals(first)
+    assert reader.requests == 0
+    assert reader.bytes_fetched == 0
+
+
+def test_object_replaced_mid_read_is_reopened(s3, tmp_path):
+    _upload(s3, _table(seed=1))
+    replacement = _table(rows_per_symbol=6000, seed=2)
+
+    class ReplacingClient:
+        """Перезаписывает объект перед вторым GET — как загрузка новой консолидации"""
+
+        def __init__(self):
+            self.gets = 0
+
+        def __getattr__(self, name):
+            return getattr(s3, name)
+
+        def get_object(self, **kwargs):
+            self.gets += 1
+            if self.gets == 2:
+                _upload(s3, replacement)
+            return s3.get_object(**kwargs)
+
+    remote, _ = read_remote_parquet(KEY, client=ReplacingClient(), bucket=BUCKET,
+                                    block_size=BLOCK_SIZE, cache_dir=str(tmp_path / "cache"))
+    assert remote.equals(replacement)